@@ -80,6 +80,9 @@ class Client(object):
         >>> client.gauge('some.gauge',42)
         """
         stats = {stat: "%f|g" % value}
+        if value < 0:
+            # A leading sign makes a gauge a delta, so a negative value is set by zeroing the gauge first
+            stats = {stat: ["0|g", "%f|g" % value]}
         self.send(stats, sample_rate, tags)
 
     def increment(self, stats, sample_rate=1, tags=None):
@@ -119,26 +122,28 @@ class Client(object):
         Squirt the metrics over UDP
         <name>:<value>|<metric_type>|@<sample_rate>|#<tag1_name>:<tag1_value>,
                             <tag2_name>:<tag2_value>:<value>|<metric_type>...
+        A list of values for a stat goes out as lines of a single packet, in order.
         """
 
+        data = dict((stat, value if isinstance(value, list) else [value]) for stat, value in data.items())
         if self.prefix:
             data = dict((".".join((self.prefix, stat)), value) for stat, value in data.items())
 
         if sample_rate < 1:
             if random.random() > sample_rate:
                 return
-            sampled_data = dict((stat, "%s|@%s" % (value, sample_rate))
-                                for stat, value in data.items())
+            sampled_data = dict((stat, ["%s|@%s" % (value, sample_rate) for value in values])
+                                for stat, values in data.items())
         else:
             sampled_data = data
 
         if tags:
             tags_string = ",".join(("%s:%s" % key_val for key_val in tags.items()))
-            sampled_data = dict((stat, "%s|#%s" % (value, tags_string))
-                                for stat, value in sampled_data.items())
+            sampled_data = dict((stat, ["%s|#%s" % (value, tags_string) for value in values])
+                                for stat, values in sampled_data.items())
 
-        [self._send_packet("%s:%s" % (stat, value))
-         for stat, value in sampled_data.items()]
+        [self._send_packet("\n".join("%s:%s" % (stat, value) for value in values))
+         for stat, values in sampled_data.items()]
 
     def _send_packet(self, packet):
         try:
@@ -0,0 +1,151 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""StatsD server driven by an asyncio event loop (python 3 only).
+
+Datagrams are processed by a DatagramProtocol and flushes are scheduled on the loop, so ingestion and flushing
+never run concurrently. Sinks, which may block on the network, run on workers of their own.
+"""
+
+import asyncio
+import logging
+import os
+import signal
+
+from .statsd_server import Server
+from .streams import LineBuffer
+
+logger = logging.getLogger(__name__)
+
+
+class StatsdProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        try:
+            self.server.process(data.decode('UTF-8'))
+        except Exception as error:
+            logger.exception("Bad data from %s: %s", addr, error)
+
+    def error_received(self, exc):
+        logger.warning("StatsD socket error: %s", exc)
+
+
+class StatsdStreamProtocol(asyncio.Protocol):
+    def __init__(self, server):
+        self.server = server
+        self.lines = LineBuffer()
+        self.peer = None
+
+    def connection_made(self, transport):
+        self.peer = transport.get_extra_info('peername') or transport.get_extra_info('sockname')
+
+    def data_received(self, data):
+        self._process(self.lines.feed(data))
+
+    def connection_lost(self, exc):
+        self._process(self.lines.close())
+
+    def _process(self, data):
+        if not data:
+            return
+        try:
+            self.server.process(data.decode('UTF-8'))
+        except Exception as error:
+            logger.exception("Bad data from %s: %s", self.peer, error)
+
+
+class AsyncServer(Server):
+    def __init__(self, *args, **kwargs):
+        super(AsyncServer, self).__init__(*args, **kwargs)
+        self.loop = None
+        self._transport = None
+        self._flush_handle = None
+        self._stream_servers = []
+
+    def listen(self, loop, hostname='localhost', port=8142):
+        """Binds the UDP socket and schedules the first flush on the given loop."""
+        self.loop = loop
+        self._bind(hostname, port)
+        self._sock.setblocking(False)
+
+        self._transport, _ = loop.run_until_complete(
+            loop.create_datagram_endpoint(lambda: StatsdProtocol(self), sock=self._sock))
+
+        if self.tcp_port:
+            self._stream_servers.append(loop.run_until_complete(
+                loop.create_server(lambda: StatsdStreamProtocol(self), hostname, self.tcp_port)))
+            logger.debug("StatsD Server listening on '%s' TCP port %d", hostname, self.tcp_port)
+        if self.unix_socket:
+            if os.path.exists(self.unix_socket):
+                os.remove(self.unix_socket)
+            self._stream_servers.append(loop.run_until_complete(
+                loop.create_unix_server(lambda: StatsdStreamProtocol(self), self.unix_socket)))
+            logger.debug("StatsD Server listening on unix socket %s", self.unix_socket)
+
+        self._set_timer()
+
+    def _set_timer(self):
+        self._flush_handle = self.loop.call_later(self.flush_interval, self.on_timer)
+
+    def on_timer(self):
+        """Drains the aggregates on the loop and hands them to the sink workers. Errors are logged so one failed
+        flush doesn't stop the next one from being scheduled.
+        """
+        self._set_timer()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.exception('Error while flushing: %s', e)
+
+    def serve(self, hostname='localhost', port=8142):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.listen(loop, hostname, port)
+        self.start_sinks()
+
+        loop.add_signal_handler(signal.SIGTERM, self.stop)
+        loop.add_signal_handler(signal.SIGINT, self.stop)
+
+        try:
+            loop.run_forever()
+        finally:
+            self.stop_sinks()
+            loop.close()
+
+    def stop(self):
+        logger.debug("Stopping server...")
+        if self._flush_handle:
+            self._flush_handle.cancel()
+        if self._transport:
+            self._transport.close()
+        for stream_server in self._stream_servers:
+            stream_server.close()
+        if self.unix_socket and os.path.exists(self.unix_socket):
+            os.remove(self.unix_socket)
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,80 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Fixed-bucket histograms.
+
+A histogram counts the values falling at or below each of a fixed set of upper bounds, in one small array per
+series, so its memory doesn't depend on the number of values and recording a value is a binary search.
+"""
+
+from array import array
+from bisect import bisect_left
+
+# Upper bounds, in ms, used when no bounds are configured for a histogram
+DEFAULT_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def bucket_suffix(bound):
+    """
+    :return: the name suffix of the bucket counting values at or below bound, e.g. bucket_le_2_5
+    """
+    if bound is None:
+        return 'bucket_le_inf'
+    return 'bucket_le_' + ('%g' % bound).replace('.', '_')
+
+
+class Histogram(object):
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        """
+        :param bounds: the sorted upper bounds of the buckets; larger values fall in a final, unbounded bucket
+        """
+        self.bounds = bounds
+        self.counts = array('d', [0.0]) * (len(bounds) + 1)
+
+    def __len__(self):
+        return int(sum(self.counts))
+
+    def add(self, value, count=1):
+        self.counts[bisect_left(self.bounds, value)] += count
+
+    def merge(self, other):
+        """Adds the counts of another histogram with the same bounds to this one."""
+        if other.bounds != self.bounds:
+            raise ValueError("Can't merge histograms with different buckets")
+        counts = self.counts
+        for i, count in enumerate(other.counts):
+            counts[i] += count
+
+    def cumulative(self):
+        """
+        :return: a list of (bound, count of values at or below bound), ending with (None, count of all values)
+        """
+        result = []
+        total = 0
+        for bound, count in zip(tuple(self.bounds) + (None,), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
@@ -0,0 +1,100 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""HyperLogLog cardinality estimator for StatsD sets.
+
+Estimates the number of distinct values added, in a fixed number of one byte registers (Flajolet, Fusy, Gandouet
+and Meunier, "HyperLogLog: the analysis of a near-optimal cardinality estimation algorithm", 2007). The standard
+error is about 1.04 / sqrt(2 ** precision). Sketches of the same precision merge exactly, e.g. across StatsD worker
+processes, because values are hashed the same way in every process.
+"""
+
+import hashlib
+import math
+import struct
+
+# 4096 registers, 4KB per set, with a standard error of about 1.6%
+DEFAULT_PRECISION = 12
+
+MIN_PRECISION = 4
+MAX_PRECISION = 16
+
+
+def _hash(value):
+    return struct.unpack('<Q', hashlib.md5(value.encode('utf-8')).digest()[:8])[0]
+
+
+class HyperLogLog(object):
+    def __init__(self, precision=DEFAULT_PRECISION):
+        if not MIN_PRECISION <= precision <= MAX_PRECISION:
+            raise ValueError("Precision must be between {} and {}: {}".format(MIN_PRECISION, MAX_PRECISION,
+                                                                               precision))
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        """Adds a value, given as a string, to the set."""
+        x = _hash(value)
+        index = x >> (64 - self.precision)
+        # Position of the leftmost 1 in the remaining bits, counting from 1
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Merges another set of the same precision into this one."""
+        if other.precision != self.precision:
+            raise ValueError("Can't merge sets with different precisions")
+        registers = self.registers
+        for index, rank in enumerate(other.registers):
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def cardinality(self):
+        """
+        :return: the estimated number of distinct values added
+        """
+        m = len(self.registers)
+        estimate = _alpha(m) * m * m / sum([2.0 ** -rank for rank in self.registers])
+
+        if estimate <= 2.5 * m:
+            # Small range correction
+            zeros = self.registers.count(0)
+            if zeros:
+                estimate = m * math.log(float(m) / zeros)
+
+        return estimate
+
+
+def _alpha(m):
+    if m == 16:
+        return 0.673
+    if m == 32:
+        return 0.697
+    if m == 64:
+        return 0.709
+    return 0.7213 / (1 + 1.079 / m)
@@ -0,0 +1,112 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Parser for the StatsD line protocol understood by Server.process."""
+
+import re
+from collections import OrderedDict
+
+RE_WHITESPACE = re.compile(r'\s+')
+RE_INVALID_KEY_CHARS = re.compile(r'[^a-zA-Z_\-0-9\.]')
+RE_SAMPLE_RATE = re.compile(r'^@([\d\.]+)')
+
+# Distinct metric names and tag strings remembered by the parser
+CACHE_SIZE = 10000
+
+
+def clean_key(k):
+    return RE_INVALID_KEY_CHARS.sub('', RE_WHITESPACE.sub('_', k.replace('/', '-').replace(' ', '_')))
+
+
+def parse_tags(tag_string):
+    return tuple(sorted([tuple(x.split(':')) for x in tag_string.lower().split(',')]))
+
+
+class BoundedCache(object):
+    """FIFO memo of the results of a function, holding at most size entries."""
+
+    def __init__(self, func, size=CACHE_SIZE):
+        self.func = func
+        self.size = size
+        self.cache = OrderedDict()
+
+    def get(self, arg):
+        try:
+            return self.cache[arg]
+        except KeyError:
+            pass
+
+        result = self.func(arg)
+        self.cache[arg] = result
+        if len(self.cache) > self.size:
+            self.cache.popitem(last=False)  # FIFO
+        return result
+
+
+class MetricParser(object):
+    """Splits metric lines of the form name:value|type[|@rate][|#tag:value,...] in a single pass.
+
+    The same metric names and tag sets repeat on every interval, so cleaned keys and sorted tag tuples
+    are memoized instead of being recomputed per line.
+    """
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.keys = BoundedCache(clean_key, cache_size)
+        self.tags = BoundedCache(parse_tags, cache_size)
+
+    def parse(self, line):
+        """
+        Parses a single metric line.
+
+        :param line: the metric line, without its trailing newline
+        :return: a (key, value, metric_type, rest, tags) tuple, or None if the line is malformed
+        """
+        name, sep, remainder = line.partition(':')
+        if not sep or not name:
+            return None
+
+        value, sep, remainder = remainder.partition('|')
+        if not sep or not value or not remainder:
+            return None
+
+        rest = remainder.split('|')
+        m_type = rest.pop(0)
+
+        tags = None
+        if rest and rest[-1].startswith('#'):
+            tags = self.tags.get(rest.pop()[1:])
+
+        return self.keys.get(name), value, m_type, rest, tags
+
+
+def parse_sample_rate(field):
+    """
+    Parses a sample rate field of the form @<rate>.
+
+    :param field: the field following the metric type
+    :return: the sample rate as a float
+    """
+    return float(RE_SAMPLE_RATE.match(field).group(1))
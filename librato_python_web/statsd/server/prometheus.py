@@ -0,0 +1,211 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Prometheus text exposition of the last flush.
+
+A PrometheusSink renders every snapshot it's handed into the text exposition format, once per flush, and serves the
+rendered text at /metrics, so scrapes cost a copy of the cached text however often they come. Counters are rendered
+as counters, gauges and sets as gauges, timers as summaries and histograms as histograms, with the tags of their
+context as labels. Like every measurement of a snapshot, the quantiles, counts and sums of timers and histograms
+cover the last flush interval only.
+"""
+
+import logging
+import math
+import re
+import threading
+from collections import OrderedDict
+
+from six.moves import BaseHTTPServer, socketserver
+
+from .parser import BoundedCache
+from .sinks import Sink, PROMETHEUS
+from .snapshot import COUNT, COUNTER, HISTOGRAM, SET, SUMMARY, TIMER, tag_dict
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+METRICS_PATH = '/metrics'
+
+_INVALID_NAME_CHARS = re.compile(r'[^a-zA-Z0-9_:]')
+_INVALID_LABEL_CHARS = re.compile(r'[^a-zA-Z0-9_]')
+
+
+def metric_name(name):
+    """
+    :return: a metric name with the characters Prometheus doesn't allow replaced with underscores
+    """
+    name = _INVALID_NAME_CHARS.sub('_', name)
+    return '_' + name if name[:1].isdigit() else name
+
+
+def render_labels(tags):
+    """
+    :param tags: the tags of a measurement, as a tuple of (name, value) tuples
+    :return: the tags as comma-separated label pairs, without braces
+    """
+    labels = []
+    for name, value in sorted(tag_dict(tags).items()):
+        name = _INVALID_LABEL_CHARS.sub('_', name)
+        if name[:1].isdigit():
+            name = '_' + name
+        value = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        labels.append('{}="{}"'.format(name, value))
+    return ','.join(labels)
+
+
+def format_value(value):
+    value = float(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(value)
+
+
+class Renderer(object):
+    """Renders snapshots, remembering the names and labels it rendered for the next snapshots."""
+
+    def __init__(self):
+        self._names = BoundedCache(metric_name)
+        self._labels = BoundedCache(render_labels)
+
+    def render(self, snapshot):
+        """
+        :return: the measurements of a snapshot in the text exposition format, as bytes
+        """
+        # The samples of a metric have to follow its TYPE line, whatever order their contexts came in
+        families = OrderedDict()
+
+        def sample(family, kind, suffix, labels, value, extra=None):
+            if family not in families:
+                families[family] = (kind, [])
+            elif families[family][0] != kind:
+                logger.debug("Not rendering %s as a %s, it's already a %s", family, kind, families[family][0])
+                return
+            if extra:
+                labels = '{},{}'.format(labels, extra) if labels else extra
+            families[family][1].append('{}{}{} {}'.format(family, suffix, '{' + labels + '}' if labels else '',
+                                                          format_value(value)))
+
+        for measurement in snapshot.measurements:
+            name = self._names.get(measurement.name)
+            labels = self._labels.get(measurement.tags)
+            kind = measurement.kind
+            value = measurement.value
+
+            if kind == COUNTER:
+                sample(name + '_total', 'counter', '', labels, value)
+            elif kind in (COUNT, SET):
+                sample(name + '_count', 'gauge', '', labels, value)
+            elif kind == TIMER:
+                quantiles = OrderedDict([(0.5, value.median)])
+                for pct, threshold in value.percentiles:
+                    quantiles[round(pct / 100.0, 6)] = threshold
+                for quantile in sorted(quantiles):
+                    sample(name, 'summary', '', labels, quantiles[quantile],
+                           'quantile="{}"'.format(format_value(quantile)))
+                # Samples are scaled up by their sample rates, like the count
+                sample(name, 'summary', '_sum', labels, value.sum * value.weighted_count / value.count)
+                sample(name, 'summary', '_count', labels, value.weighted_count)
+            elif kind == HISTOGRAM:
+                for bound, count in value:
+                    sample(name, 'histogram', '_bucket', labels, count,
+                           'le="{}"'.format(format_value(bound if bound is not None else float('inf'))))
+                sample(name, 'histogram', '_count', labels, value[-1][1])
+            elif kind == SUMMARY:
+                sample(name, 'summary', '_sum', labels, value.sum)
+                sample(name, 'summary', '_count', labels, value.count)
+            else:
+                sample(name, 'gauge', '', labels, value)
+
+        lines = []
+        for family, (kind, samples) in families.items():
+            lines.append('# TYPE {} {}'.format(family, kind))
+            lines.extend(samples)
+        return ('\n'.join(lines) + '\n' if lines else '').encode('utf-8')
+
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != METRICS_PATH:
+            self.send_error(404)
+            return
+
+        body = self.server.body
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("Prometheus scrape from %s: %s", self.address_string(), format % args)
+
+
+class MetricsServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, hostname, port):
+        BaseHTTPServer.HTTPServer.__init__(self, (hostname, port), MetricsHandler)
+        # The rendering of the last snapshot, replaced as a whole so scrapes never see half of one
+        self.body = b''
+
+
+class PrometheusSink(Sink):
+    """Serves the last snapshot in the text exposition format at /metrics."""
+
+    name = PROMETHEUS
+
+    def __init__(self, port, hostname=''):
+        """
+        :param port: the TCP port of the endpoint, 0 for any free port
+        :param hostname: the address the endpoint listens on, all of them by default
+        """
+        self.port = port
+        self.hostname = hostname
+        self.renderer = Renderer()
+        self.httpd = None
+
+    def start(self):
+        # Bound once the server runs, so forked workers don't inherit the listening socket
+        self.httpd = MetricsServer(self.hostname, self.port)
+        self.port = self.httpd.server_address[1]
+        thread = threading.Thread(target=self.httpd.serve_forever, name='statsd-prometheus')
+        thread.daemon = True
+        thread.start()
+        logger.debug("Serving Prometheus metrics on '%s' TCP port %d", self.hostname, self.port)
+
+    def send(self, snapshot):
+        body = self.renderer.render(snapshot)
+        if self.httpd:
+            self.httpd.body = body
+
+    def close(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
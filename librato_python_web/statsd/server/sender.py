@@ -0,0 +1,228 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Submission of flushed measurements from a thread of their own.
+
+The flushing thread hands each finished queue of measurements to a Sender and goes back to aggregating, so a slow
+or failing metrics API delays submissions rather than the flushes. Queues wait in a bounded buffer, oldest first,
+and are retried with exponential backoff until they are accepted. With a spool, queues wait on disk instead, and
+survive restarts.
+"""
+
+import json
+import logging
+import threading
+from collections import deque
+
+from librato.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Flushed queues held while the API is slow or unreachable, about an hour at the default flush interval
+DEFAULT_MAX_PENDING = 60
+
+# Seconds waited after a first failed submission, doubled after every failure up to the maximum
+RETRY_INITIAL = 1.0
+RETRY_MAX = 60.0
+
+# Seconds stop() waits for the pending queues to be submitted
+STOP_TIMEOUT = 5.0
+
+# Client errors worth retrying: request timeouts, and the API's rate limit
+RETRYABLE_STATUSES = (408, 429)
+
+
+def submit_chunks(queue):
+    """
+    Submits the chunks of a librato queue one at a time. Each chunk is removed once it's accepted, so a submission
+    that fails half way resumes where it stopped rather than resending everything.
+    """
+    connection = queue.connection
+    while queue.chunks:
+        connection._mexe("metrics", method="POST", query_props=queue.chunks[0])
+        queue.chunks.pop(0)
+    while queue.tagged_chunks:
+        connection._mexe("measurements", method="POST", query_props=queue.tagged_chunks[0])
+        queue.tagged_chunks.pop(0)
+
+
+def dump_queue(queue):
+    """
+    :return: the chunks of a librato queue, as bytes
+    """
+    return json.dumps({'chunks': queue.chunks, 'tagged_chunks': queue.tagged_chunks}).encode('utf-8')
+
+
+def load_queue(queue, data):
+    """
+    Restores chunks saved by dump_queue() into an empty librato queue.
+
+    :return: the queue
+    """
+    chunks = json.loads(bytes(data).decode('utf-8'))
+    queue.chunks = chunks['chunks']
+    queue.tagged_chunks = chunks['tagged_chunks']
+    return queue
+
+
+class Sender(object):
+    def __init__(self, submit=submit_chunks, max_pending=DEFAULT_MAX_PENDING, retry_initial=RETRY_INITIAL,
+                 retry_max=RETRY_MAX, spool=None, new_queue=None):
+        """
+        :param submit: the function submitting a queue, raising an exception if it wasn't accepted
+        :param max_pending: the maximum number of queues waiting to be submitted, the oldest is dropped beyond it
+        :param retry_initial: the seconds to wait before retrying a failed submission
+        :param retry_max: the maximum seconds to wait between retries
+        :param spool: a Spool the queues wait in instead, bounded by its own caps, or None
+        :param new_queue: the function creating the queues spooled queues are loaded into
+        """
+        self.submit = submit
+        self.max_pending = max_pending
+        self.retry_initial = retry_initial
+        self.retry_max = retry_max
+        self.spool = spool
+        self.new_queue = new_queue
+        # Queues, or spool records when there's a spool
+        self.pending = deque()
+        # The spool record being submitted, and its queue, which keeps track of the chunks already accepted
+        self._current = None, None
+        self.stats = self._new_stats()
+        self._cond = threading.Condition()
+        self._stopping = threading.Event()
+        self._abandoned = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _new_stats():
+        return {'sent': 0, 'retries': 0, 'dropped': 0, 'rejected': 0}
+
+    def send(self, queue):
+        """Queues measurements for submission, dropping the oldest pending queue if the buffer is full."""
+        if self.spool:
+            record = self.spool.append(dump_queue(queue))
+            with self._cond:
+                self.pending.append(record)
+                self._cond.notify()
+            return
+
+        with self._cond:
+            if len(self.pending) >= self.max_pending:
+                self.pending.popleft()
+                self.stats['dropped'] += 1
+                logger.warning("Dropping the oldest of %d unsent flushes", len(self.pending) + 1)
+            self.pending.append(queue)
+            self._cond.notify()
+
+    def take_stats(self):
+        """
+        :return: the counts of queues sent, retried, dropped and rejected since the last call, and the number of
+                 queues pending
+        """
+        with self._cond:
+            stats, self.stats = self.stats, self._new_stats()
+            stats['pending'] = len(self.pending)
+        return stats
+
+    def start(self):
+        if self.spool:
+            # Replay what wasn't submitted before a restart
+            replayed = self.spool.pending()
+            if replayed:
+                logger.info("Replaying %d spooled flushes", len(replayed))
+            with self._cond:
+                self.pending.extendleft(reversed(replayed))
+        self._thread = threading.Thread(target=self._run, name='statsd-sender')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """Stops the sender once the pending queues are submitted, giving up on them after timeout seconds."""
+        with self._cond:
+            self._stopping.set()
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+        self._abandoned.set()
+
+    def _next(self):
+        with self._cond:
+            while not self.pending and not self._stopping.is_set():
+                self._cond.wait()
+            return self.pending[0] if self.pending else None
+
+    def _run(self):
+        delay = self.retry_initial
+        while True:
+            entry = self._next()
+            if entry is None:
+                return
+
+            queue = self._load(entry) if self.spool else entry
+            if queue is None:
+                # Deleted from the spool to make room, or past its age cap
+                self._done(entry, 'dropped')
+                continue
+
+            try:
+                self.submit(queue)
+            except ClientError as e:
+                if e.code not in RETRYABLE_STATUSES:
+                    # Retrying a request the API refused won't help
+                    logger.error("Dropping measurements rejected by the API: %s", e)
+                    self._done(entry, 'rejected')
+                    continue
+                error = e
+            except Exception as e:
+                error = e
+            else:
+                self._done(entry, 'sent')
+                delay = self.retry_initial
+                continue
+
+            if self._abandoned.is_set():
+                logger.error("Giving up on %d unsent flushes: %s", len(self.pending), error)
+                return
+            logger.warning("Submission failed, retrying in %ss: %s", delay, error)
+            with self._cond:
+                self.stats['retries'] += 1
+            self._abandoned.wait(delay)
+            delay = min(delay * 2, self.retry_max)
+
+    def _load(self, record):
+        if self._current[0] != record:
+            data = self.spool.read(record)
+            self._current = record, load_queue(self.new_queue(), data) if data is not None else None
+        return self._current[1]
+
+    def _done(self, entry, outcome):
+        if self.spool:
+            self.spool.ack(entry)
+            self._current = None, None
+        with self._cond:
+            # The queue may have been dropped to make room while it was being submitted
+            if self.pending and self.pending[0] is entry:
+                self.pending.popleft()
+            self.stats[outcome] += 1
@@ -0,0 +1,255 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Sinks receiving the snapshot of every flush.
+
+A sink is handed each Snapshot by a SinkWorker, on a thread of its own, so a slow or failing sink delays its own
+deliveries rather than the flushes or the other sinks. Workers hold a bounded number of snapshots, dropping the oldest
+when a sink falls behind. Until it's started, a worker delivers on the calling thread, which is how sinks are fed
+offline.
+"""
+
+import json
+import logging
+import sys
+import threading
+import timeit
+from collections import deque
+
+from .snapshot import tag_dict
+
+logger = logging.getLogger(__name__)
+
+# Snapshots held for a sink that falls behind, the oldest is dropped beyond it
+DEFAULT_MAX_PENDING = 10
+
+# Seconds stop() waits for the pending snapshots to be delivered
+STOP_TIMEOUT = 5.0
+
+LIBRATO = 'librato'
+STDOUT = 'stdout'
+FILE = 'file'
+MEMORY = 'memory'
+PROMETHEUS = 'prometheus'
+
+
+class Sink(object):
+    """Receives the snapshot of every flush."""
+
+    name = None
+
+    def start(self):
+        """Acquires what the sink needs to deliver, such as sockets or threads, when the server starts."""
+        pass
+
+    def send(self, snapshot):
+        """Delivers a snapshot, raising an exception if it couldn't be."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class LibratoSink(Sink):
+    """Submits snapshots to the metrics API, from the sender of the server when it has one."""
+
+    name = LIBRATO
+
+    def __init__(self, server):
+        self.server = server
+
+    def send(self, snapshot):
+        queue = self.server.queue_snapshot(snapshot)
+        if self.server.sender:
+            self.server.sender.send(queue)
+        else:
+            self.server.submit(queue)
+
+
+class StreamSink(Sink):
+    """Writes every measurement as a line of JSON to a file object."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def send(self, snapshot):
+        lines = [json.dumps(to_json(measurement, snapshot.timestamp)) for measurement in snapshot.measurements]
+        if lines:
+            self.stream.write('\n'.join(lines) + '\n')
+            self.stream.flush()
+
+
+class StdoutSink(StreamSink):
+    name = STDOUT
+
+    def __init__(self):
+        super(StdoutSink, self).__init__(sys.stdout)
+
+
+class FileSink(StreamSink):
+    """Appends every measurement as a line of JSON to a file."""
+
+    name = FILE
+
+    def __init__(self, path):
+        super(FileSink, self).__init__(open(path, 'a'))
+
+    def close(self):
+        self.stream.close()
+
+
+class MemorySink(Sink):
+    """Keeps the last snapshots in memory, only the last one by default."""
+
+    name = MEMORY
+
+    def __init__(self, max_snapshots=1):
+        """
+        :param max_snapshots: the number of snapshots kept, 0 keeps them all
+        """
+        self.snapshots = deque(maxlen=max_snapshots or None)
+
+    def send(self, snapshot):
+        self.snapshots.append(snapshot)
+
+    @property
+    def last(self):
+        return self.snapshots[-1] if self.snapshots else None
+
+
+def to_json(measurement, timestamp):
+    """
+    :return: a measurement as a dict ready to be serialized to JSON
+    """
+    value = measurement.value
+    if hasattr(value, '_asdict'):
+        value = dict(value._asdict())
+        if 'percentiles' in value:
+            value['percentiles'] = dict(value['percentiles'])
+    return {'time': timestamp, 'name': measurement.name, 'type': measurement.kind, 'value': value,
+            'tags': tag_dict(measurement.tags)}
+
+
+def benchmark(sink, snapshot, repeat=100):
+    """Times the delivery of a snapshot to a sink on the calling thread, with no server involved.
+
+    :return: the seconds it takes to deliver the snapshot, on average
+    """
+    start = timeit.default_timer()
+    for _ in range(repeat):
+        sink.send(snapshot)
+    return (timeit.default_timer() - start) / repeat
+
+
+class SinkWorker(object):
+    def __init__(self, sink, max_pending=DEFAULT_MAX_PENDING):
+        """
+        :param sink: the sink snapshots are delivered to
+        :param max_pending: the maximum number of snapshots waiting to be delivered, the oldest is dropped beyond it
+        """
+        self.sink = sink
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.stats = self._new_stats()
+        self._cond = threading.Condition()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _new_stats():
+        return {'sent': 0, 'errors': 0, 'dropped': 0}
+
+    @property
+    def name(self):
+        return self.sink.name
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def send(self, snapshot):
+        """Queues a snapshot for delivery, dropping the oldest pending snapshot if the buffer is full."""
+        if not self.running:
+            self._deliver(snapshot)
+            return
+
+        with self._cond:
+            if len(self.pending) >= self.max_pending:
+                self.pending.popleft()
+                self.stats['dropped'] += 1
+                logger.warning("Dropping the oldest of %d snapshots pending for the %s sink",
+                               len(self.pending) + 1, self.name)
+            self.pending.append(snapshot)
+            self._cond.notify()
+
+    def take_stats(self):
+        """
+        :return: the counts of snapshots delivered, failed and dropped since the last call, and the number of
+                 snapshots pending
+        """
+        with self._cond:
+            stats, self.stats = self.stats, self._new_stats()
+            stats['pending'] = len(self.pending)
+        return stats
+
+    def start(self):
+        self.sink.start()
+        self._thread = threading.Thread(target=self._run, name='statsd-sink-{}'.format(self.name))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """Stops the worker once the pending snapshots are delivered, giving up on them after timeout seconds."""
+        with self._cond:
+            self._stopping.set()
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.error("Giving up on %d snapshots pending for the %s sink", len(self.pending), self.name)
+                return
+        self.sink.close()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self.pending and not self._stopping.is_set():
+                    self._cond.wait()
+                if not self.pending:
+                    return
+                snapshot = self.pending.popleft()
+            self._deliver(snapshot)
+
+    def _deliver(self, snapshot):
+        try:
+            self.sink.send(snapshot)
+        except Exception as e:
+            logger.exception("Error while sending to the %s sink: %s", self.name, e)
+            outcome = 'errors'
+        else:
+            outcome = 'sent'
+        with self._cond:
+            self.stats[outcome] += 1
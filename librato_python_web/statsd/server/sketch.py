@@ -0,0 +1,180 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Bounded-memory, mergeable quantile sketch for timer values.
+
+An implementation of DDSketch (Masson, Rim and Lee, "DDSketch: A Fast and Fully-Mergeable Quantile Sketch with
+Relative-Error Guarantees", VLDB 2019). Values are counted in logarithmically sized buckets, so any quantile is
+estimated within the configured relative accuracy, no matter how many values were added. Sketches built with the
+same accuracy merge exactly, e.g. across StatsD worker processes.
+"""
+
+import math
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+# Upper bound on the buckets per sign. At 1% accuracy, 2048 buckets span more than 17 orders of magnitude.
+DEFAULT_MAX_BINS = 2048
+
+# Values closer to zero than this are counted as zero
+MIN_INDEXABLE_VALUE = 1e-9
+
+
+class DDSketch(object):
+    """
+    Quantile sketch with a relative error guarantee. Count, min, max, sum and sum of squares are tracked exactly.
+
+    :param relative_accuracy: the maximum relative error of estimated quantiles, e.g. 0.01 for 1%
+    :param max_bins: the most buckets kept for each sign; beyond that the lowest buckets are collapsed, which only
+        affects the accuracy of the lowest quantiles
+    """
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY, max_bins=DEFAULT_MAX_BINS):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("Relative accuracy must be between 0 and 1: {}".format(relative_accuracy))
+
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.sum = 0.0
+        self.sum_squares = 0.0
+
+    def __len__(self):
+        return self.count
+
+    def _index(self, value):
+        return int(math.ceil(math.log(value) / self._log_gamma))
+
+    def _value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def append(self, value):
+        """Adds a single value to the sketch."""
+        if value > MIN_INDEXABLE_VALUE:
+            self._add_to_bin(self.positive, self._index(value), 1)
+        elif value < -MIN_INDEXABLE_VALUE:
+            self._add_to_bin(self.negative, self._index(-value), 1)
+        else:
+            self.zero_count += 1
+
+        self.count += 1
+        self.sum += value
+        self.sum_squares += value * value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def extend(self, values):
+        """Adds a sequence of values, or merges another sketch built with the same accuracy."""
+        if not isinstance(values, DDSketch):
+            for value in values:
+                self.append(value)
+            return
+
+        other = values
+        if other.gamma != self.gamma:
+            raise ValueError("Can't merge sketches with different accuracies")
+        if other.count == 0:
+            return
+
+        for index, count in other.positive.items():
+            self._add_to_bin(self.positive, index, count)
+        for index, count in other.negative.items():
+            self._add_to_bin(self.negative, index, count)
+        self.zero_count += other.zero_count
+
+        self.count += other.count
+        self.sum += other.sum
+        self.sum_squares += other.sum_squares
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def _add_to_bin(self, bins, index, count):
+        bins[index] = bins.get(index, 0) + count
+        if len(bins) > self.max_bins:
+            self._collapse(bins)
+
+    def _collapse(self, bins):
+        # Fold the lowest buckets into the lowest one that's kept
+        indexes = sorted(bins)
+        excess = len(indexes) - self.max_bins
+        target = indexes[excess]
+        for index in indexes[:excess]:
+            bins[target] += bins.pop(index)
+
+    def quantile(self, q):
+        """
+        Estimates a quantile of the values added so far.
+
+        :param q: the quantile, between 0 and 1
+        :return: the estimated value, or None if the sketch is empty
+        """
+        return self.quantiles([q])[0]
+
+    def quantiles(self, qs):
+        """
+        Estimates several quantiles in a single walk over the buckets.
+
+        :param qs: the quantiles, each between 0 and 1
+        :return: the estimated values, in the order of qs, or Nones if the sketch is empty
+        """
+        if self.count == 0:
+            return [None] * len(qs)
+
+        pending = sorted(range(len(qs)), key=lambda i: qs[i])
+        results = [self.max] * len(qs)
+        seen = 0
+
+        for value, count in self._buckets():
+            seen += count
+            while pending and seen > qs[pending[0]] * (self.count - 1):
+                results[pending.pop(0)] = self._clamp(value)
+            if not pending:
+                break
+
+        return results
+
+    def _buckets(self):
+        """Yields (value, count) for every bucket, in ascending order of value."""
+        for index in sorted(self.negative, reverse=True):
+            yield -self._value(index), self.negative[index]
+        if self.zero_count:
+            yield 0.0, self.zero_count
+        for index in sorted(self.positive):
+            yield self._value(index), self.positive[index]
+
+    def _clamp(self, value):
+        return min(max(value, self.min), self.max)
@@ -0,0 +1,69 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Immutable snapshots of flushed aggregates.
+
+Every flush drains the aggregates into a Snapshot, the measurements of one interval, which is handed to each sink.
+Snapshots are made of tuples only, so they can be shared by sinks running on different threads, and built without a
+server or a network, to feed sinks offline.
+"""
+
+from collections import namedtuple
+
+# Kinds of measurements
+# The running total of a counter
+COUNTER = 'counter'
+# The count of a counter over the interval only
+COUNT = 'count'
+GAUGE = 'gauge'
+# The estimated number of unique values of a set
+SET = 'set'
+# A TimerSummary of the values of a timer
+TIMER = 'timer'
+# The cumulative counts of a histogram, as a tuple of (upper bound, count) pairs ending with (None, total)
+HISTOGRAM = 'histogram'
+# A GaugeSummary of several samples of a gauge
+SUMMARY = 'summary'
+
+# The value of a measurement of the given kind, with the tags of its context as a tuple of (name, value) tuples
+Measurement = namedtuple('Measurement', 'name kind value tags')
+
+# percentiles is a tuple of (pct, value) pairs, count is the number of values and weighted_count the number scaled up
+# by their sample rates
+TimerSummary = namedtuple('TimerSummary', 'count weighted_count min max mean median percentiles sum sum_squares')
+
+GaugeSummary = namedtuple('GaugeSummary', 'count min max sum sum_squares')
+
+# The measurements of a flush, taken at timestamp (in seconds)
+Snapshot = namedtuple('Snapshot', 'timestamp measurements')
+
+
+def tag_dict(tags):
+    """
+    :param tags: the tags of a measurement, as a tuple of (name, value) tuples
+    :return: the tags as a dict, leaving out tags without a value
+    """
+    return dict((tag[0], ':'.join(tag[1:])) for tag in tags if len(tag) > 1)
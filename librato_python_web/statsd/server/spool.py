@@ -0,0 +1,246 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Durable spool of flushed measurements waiting to be submitted.
+
+Payloads are appended to fixed-size segment files written through mmap, and acknowledged in place once they're
+accepted, so whatever wasn't submitted when the server stopped is replayed when it starts again. A segment is
+deleted once all its payloads are acknowledged, or when it's past the spool's size or age cap.
+
+Each record is a header followed by the payload:
+
+    state (1 byte, PENDING or ACKED), 3 padding bytes, length (4 bytes), crc32 of the payload (4 bytes),
+    time it was appended (8 byte double)
+
+A zero length marks the end of the records in a segment, since new segments are filled with zeros.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('<B3xIId')
+PENDING = 1
+ACKED = 2
+
+SEGMENT_SUFFIX = '.spool'
+SEGMENT_SIZE = 1024 * 1024
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_AGE = 24 * 60 * 60
+
+
+class Segment(object):
+    """One spool file, mapped in memory."""
+
+    def __init__(self, path, size=SEGMENT_SIZE):
+        """
+        :param path: the file of the segment, created with the given size if it doesn't exist
+        """
+        self.path = path
+        self.seq = int(os.path.basename(path)[:-len(SEGMENT_SUFFIX)])
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.truncate(size)
+        self.file = open(path, 'r+b')
+        self.size = os.path.getsize(path)
+        self.mmap = mmap.mmap(self.file.fileno(), self.size)
+        # Offset of the next record, number of records not acknowledged, and time the newest record was appended
+        self.end = 0
+        self.unacked = 0
+        self.newest = 0
+        self.recovered = list(self._recover())
+
+    def _recover(self):
+        """Finds the end of the records of an existing segment, and yields the offsets of those not acknowledged."""
+        while self.end + HEADER.size <= self.size:
+            state, length, crc, created = HEADER.unpack(self.mmap[self.end:self.end + HEADER.size])
+            start = self.end + HEADER.size
+            if not length or start + length > self.size or \
+                    zlib.crc32(self.mmap[start:start + length]) & 0xffffffff != crc:
+                # The end of the records, or a torn write
+                break
+            self.newest = max(self.newest, created)
+            if state == PENDING:
+                self.unacked += 1
+                yield self.end
+            self.end = start + length
+
+    def append(self, data, created):
+        """
+        :return: the offset of the new record, or None if the segment is full
+        """
+        offset = self.end
+        start = offset + HEADER.size
+        if start + len(data) > self.size:
+            return None
+
+        # The header goes last, so a record is only found once it's complete
+        self.mmap[start:start + len(data)] = data
+        self.mmap[offset:start] = HEADER.pack(PENDING, len(data), zlib.crc32(data) & 0xffffffff, created)
+        self.mmap.flush()
+        self.end = start + len(data)
+        self.unacked += 1
+        self.newest = created
+        return offset
+
+    def read(self, offset):
+        length = HEADER.unpack(self.mmap[offset:offset + HEADER.size])[1]
+        start = offset + HEADER.size
+        return self.mmap[start:start + length]
+
+    def created(self, offset):
+        return HEADER.unpack(self.mmap[offset:offset + HEADER.size])[3]
+
+    def acked(self, offset):
+        return self.mmap[offset:offset + 1] == bytearray([ACKED])
+
+    def ack(self, offset):
+        if not self.acked(offset):
+            self.mmap[offset:offset + 1] = bytearray([ACKED])
+            self.mmap.flush()
+            self.unacked -= 1
+
+    def close(self):
+        self.mmap.close()
+        self.file.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+
+class Spool(object):
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE, segment_size=SEGMENT_SIZE):
+        """
+        :param directory: the directory holding the segment files, created if needed
+        :param max_bytes: the most disk space used, the oldest segments are deleted beyond it
+        :param max_age: the seconds after which a payload is given up on, and its segment deleted, whether it was
+                        submitted or not
+        :param segment_size: the size of new segment files, in bytes
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.segment_size = segment_size
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.segments = {}
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(SEGMENT_SUFFIX):
+                segment = Segment(os.path.join(directory, name))
+                self.segments[segment.seq] = segment
+        self._active = self.segments[max(self.segments)] if self.segments else None
+        # The caps apply to what was left behind too, however long the server was down
+        self._trim(time.time())
+
+    def pending(self):
+        """
+        :return: the records that weren't acknowledged when the spool was opened, and still aren't nor are past the
+                 age cap, oldest first
+        """
+        with self._lock:
+            oldest = time.time() - self.max_age
+            return [(seq, offset) for seq in sorted(self.segments) for offset in self.segments[seq].recovered
+                    if not self.segments[seq].acked(offset) and self.segments[seq].created(offset) >= oldest]
+
+    def append(self, data):
+        """
+        :param data: the payload bytes
+        :return: the record, which can be read and acknowledged until the spool deletes its segment
+        """
+        with self._lock:
+            now = time.time()
+            offset = self._active.append(data, now) if self._active else None
+            if offset is None:
+                self._active = self._new_segment(HEADER.size + len(data))
+                offset = self._active.append(data, now)
+            record = self._active.seq, offset
+            self._trim(now)
+            return record
+
+    def read(self, record):
+        """
+        :return: the payload of a record, or None if it's past the age cap or its segment was deleted to make room
+        """
+        with self._lock:
+            segment = self.segments.get(record[0])
+            if segment is None or segment.created(record[1]) + self.max_age < time.time():
+                return None
+            return segment.read(record[1])
+
+    def ack(self, record):
+        with self._lock:
+            segment = self.segments.get(record[0])
+            if segment is None:
+                return
+            segment.ack(record[1])
+            if not segment.unacked and segment is not self._active:
+                self._remove(segment)
+
+    def size(self):
+        return sum(segment.size for segment in self.segments.values())
+
+    def close(self):
+        with self._lock:
+            for segment in self.segments.values():
+                segment.close()
+            self.segments = {}
+            self._active = None
+
+    def _new_segment(self, needed):
+        if self._active is not None and not self._active.unacked:
+            self._remove(self._active)
+        seq = max(self.segments) + 1 if self.segments else 0
+        path = os.path.join(self.directory, '%016d%s' % (seq, SEGMENT_SUFFIX))
+        segment = self.segments[seq] = Segment(path, max(self.segment_size, needed))
+        return segment
+
+    def _trim(self, now):
+        """Deletes the oldest segments while they're past the age cap, or the spool is past its size cap. The
+        segment being appended to is only deleted for its age, once nothing was appended to it for that long."""
+        for seq in sorted(self.segments):
+            segment = self.segments[seq]
+            expired = segment.newest + self.max_age < now
+            if not expired and (segment is self._active or self.size() <= self.max_bytes):
+                break
+            if segment.unacked:
+                logger.warning("Deleting spool segment %s with %d unsent payloads", segment.path, segment.unacked)
+            self._remove(segment)
+            if segment is self._active:
+                self._active = None
+
+    def _remove(self, segment):
+        del self.segments[segment.seq]
+        segment.remove()
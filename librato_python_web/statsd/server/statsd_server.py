@@ -28,8 +28,9 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import re
+import errno
 import os
+import select
 import signal
 import sys
 import socket
@@ -38,13 +39,45 @@ import time
 import math
 import logging
 
+from six.moves import intern
+from six.moves import queue as Queue
+
 from .daemon import Daemon
+from .histogram import Histogram, DEFAULT_BUCKETS, bucket_suffix
+from .hyperloglog import HyperLogLog, DEFAULT_PRECISION, MIN_PRECISION, MAX_PRECISION
+from .sender import Sender, DEFAULT_MAX_PENDING, submit_chunks
+from .sinks import (FileSink, LibratoSink, MemorySink, Sink, SinkWorker, StdoutSink, FILE, LIBRATO, MEMORY,
+                    PROMETHEUS, STDOUT)
+from .sinks import DEFAULT_MAX_PENDING as DEFAULT_SINK_QUEUE_SIZE
+from .snapshot import (Measurement, Snapshot, GaugeSummary, TimerSummary, COUNT, COUNTER, GAUGE, HISTOGRAM, SET,
+                       SUMMARY, TIMER)
+from .spool import Spool, DEFAULT_MAX_AGE, DEFAULT_MAX_BYTES
+from .parser import BoundedCache, MetricParser, parse_sample_rate
+from .prometheus import PrometheusSink
+from .sketch import DDSketch, DEFAULT_RELATIVE_ACCURACY
+from .submitter import Submitter
+from .store import Generation, LastSeen, SeriesIndex, ValueColumn
+from .streams import StreamListener
+from . import summary
 
 import librato
 import librato_python_web.tools.agent_config as config
 
 LIBRATO_HOSTNAME = "metrics-api.librato.com"
 
+# What the receive stage does with new datagrams when the pipeline queue is full
+DROP_NEWEST = 'drop-newest'
+DROP_OLDEST = 'drop-oldest'
+BLOCK = 'block'
+QUEUE_POLICIES = (DROP_NEWEST, DROP_OLDEST, BLOCK)
+
+PROC_NET_UDP = ('/proc/net/udp', '/proc/net/udp6')
+
+# How timer values are stored between flushes
+TIMER_STORAGE_LIST = 'list'
+TIMER_STORAGE_SKETCH = 'sketch'
+TIMER_STORAGES = (TIMER_STORAGE_LIST, TIMER_STORAGE_SKETCH)
+
 logger = logging.getLogger(__name__)
 
 try:
@@ -55,11 +88,6 @@ except ImportError:
 __all__ = ['Server']
 
 
-def _clean_key(k):
-    return re.sub(r'[^a-zA-Z_\-0-9\.]', '',
-                  re.sub(r'\s+', '_', k.replace('/', '-').replace(' ', '_')))
-
-
 def kill_process(proc_name):
     for line in os.popen("ps ax | grep " + proc_name + " | grep -v grep"):
         fields = line.split()
@@ -67,19 +95,108 @@ def kill_process(proc_name):
         os.kill(int(pid), signal.SIGKILL)
 
 
+def read_udp_socket_stats(inode, paths=PROC_NET_UDP):
+    """
+    Looks up a UDP socket in the kernel's socket tables.
+
+    :param inode: the inode of the socket
+    :param paths: the socket tables to search
+    :return: a (rx_queue, drops) tuple with the bytes waiting in the receive queue and the number of datagrams
+        dropped since the socket was created, or None if the socket isn't listed
+    """
+    inode = str(inode)
+    for path in paths:
+        try:
+            with open(path) as f:
+                next(f)  # header
+                for line in f:
+                    fields = line.split()
+                    if len(fields) > 12 and fields[9] == inode:
+                        rx_queue = int(fields[4].split(':')[1], 16)
+                        return rx_queue, int(fields[12])
+        except (IOError, OSError, StopIteration):
+            continue
+    return None
+
+
+def percentile_suffix(pct):
+    """
+    :param pct: a percentile, e.g. 95 or 99.9
+    :return: the metric name suffix the percentile is reported under, e.g. upper_95 or upper_99_9
+    """
+    return 'upper_' + ('%g' % pct).replace('.', '_')
+
+
+def _intern(value):
+    try:
+        return intern(value)
+    except TypeError:
+        # Unicode strings can't be interned on python 2
+        return value
+
+
 class Server(object):
 
     def __init__(self, librato_user, librato_api_token,
                  pct_threshold=90, debug=False, flush_interval=60000,
                  no_aggregate_counters=False, expire=0, source_prefix='',
-                 librato_hostname=LIBRATO_HOSTNAME, prefix=None):
+                 librato_hostname=LIBRATO_HOSTNAME, prefix=None, recv_batch=0, tcp_port=None,
+                 unix_socket=None, queue_size=0, queue_policy=DROP_NEWEST, rcvbuf=0,
+                 timer_storage=TIMER_STORAGE_LIST, sketch_accuracy=DEFAULT_RELATIVE_ACCURACY,
+                 percentiles_by_prefix=None, vectorize=True, set_precision=DEFAULT_PRECISION,
+                 histogram_buckets=DEFAULT_BUCKETS, histograms_by_prefix=None, max_series=0,
+                 max_series_per_metric=0, gauge_ttl=0, send_queue_size=0, spool_dir=None,
+                 spool_max_bytes=DEFAULT_MAX_BYTES, spool_max_age=DEFAULT_MAX_AGE, submit_concurrency=0,
+                 submit_gzip=True, tagged=False, sinks=(LIBRATO,), sink_queue_size=DEFAULT_SINK_QUEUE_SIZE):
         self.buf = 8192
+        # Maximum number of datagrams drained per wakeup, 0 reads one datagram at a time
+        self.recv_batch = recv_batch
+        # Requested SO_RCVBUF size in bytes, 0 keeps the system default
+        self.rcvbuf = rcvbuf
+        self.tcp_port = tcp_port
+        # Raw buffers held between the receive and parse stages, 0 receives and parses on the same thread
+        self.queue_size = queue_size
+        if queue_policy not in QUEUE_POLICIES:
+            raise ValueError("Unsupported queue policy: {}".format(queue_policy))
+        self.queue_policy = queue_policy
+        self.unix_socket = unix_socket
         self.flush_interval = float(flush_interval/1000)
-        self.pct_threshold = pct_threshold
-
-        self.no_aggregate_counters = no_aggregate_counters
+        # Percentiles reported for every timer, unless overridden for the longest matching name prefix
+        if isinstance(pct_threshold, (list, tuple)):
+            self.percentiles = sorted(pct_threshold)
+        else:
+            self.percentiles = [pct_threshold]
+        self.percentiles_by_prefix = dict((prefix, sorted(pcts))
+                                          for prefix, pcts in dict(percentiles_by_prefix or {}).items())
+        self._prefixes = sorted(self.percentiles_by_prefix, key=len, reverse=True)
+        self._key_percentiles = BoundedCache(self._lookup_percentiles)
+        if timer_storage not in TIMER_STORAGES:
+            raise ValueError("Unsupported timer storage: {}".format(timer_storage))
+        # Timers either keep every value, or a quantile sketch with the given relative accuracy
+        self.timer_storage = timer_storage
+        self.sketch_accuracy = sketch_accuracy
+        # Summarize timer values with numpy, when it's available
+        self.vectorize = vectorize and summary.numpy is not None
+        if not MIN_PRECISION <= set_precision <= MAX_PRECISION:
+            raise ValueError("Unsupported set precision: {}".format(set_precision))
+        # Sets estimate their cardinality in 2 ** set_precision registers
+        self.set_precision = set_precision
+        # Bucket bounds of |h metrics, unless overridden for the longest matching name prefix. Timers matching a
+        # prefix are recorded as histograms too.
+        self.histogram_buckets = tuple(sorted(histogram_buckets))
+        self.histograms_by_prefix = dict((prefix, tuple(sorted(bounds)))
+                                         for prefix, bounds in dict(histograms_by_prefix or {}).items())
+        self._histogram_prefixes = sorted(self.histograms_by_prefix, key=len, reverse=True)
+        self._key_buckets = BoundedCache(self._lookup_buckets)
+
+        # Tagged measurements have no counter type, running totals would be reported as ever growing gauges, so
+        # tagged counters report the counts of each interval
+        self.no_aggregate_counters = no_aggregate_counters or tagged
         self.debug = debug
+        # Seconds after which series that weren't updated are forgotten, 0 keeps them forever
         self.expire = expire
+        # Seconds the last value of a gauge is resent for after its last update, 0 only sends updated gauges
+        self.gauge_ttl = gauge_ttl
         self.hostname = socket.gethostname()
 
         parts = librato_hostname.split("://")
@@ -97,77 +214,213 @@ class Server(object):
                                    protocol=protocol,
                                    sanitizer=librato.sanitize_metric_name)
 
-        self.counters = {}
-        self.timers = {}
-        self.gauges = {}
+        self.index = SeriesIndex(max_series, max_series_per_metric)
+        self.generation = Generation(self._new_timer_values, self._new_set, Histogram)
+        # Running totals of counters, only touched by the flushing thread
+        self.counter_totals = ValueColumn()
+        # Last value of every gauge, the base of deltas, only touched by the flushing thread
+        self.gauge_values = ValueColumn()
+        # Series of gauges that received deltas, only touched by the flushing thread
+        self._delta_gauges = set()
+        # Series updated in the last flushed generation, and those retained before it, checked again at the next swap
+        self._flushed = []
+        # When series were last updated, to find those idle for longer than expire
+        self.last_seen = LastSeen()
         self.aliases = {}
+        self.parser = MetricParser()
+        self.recv_stats = self._new_recv_stats()
+        self.queue_stats = self._new_queue_stats()
+        self._queue = Queue.Queue(queue_size) if queue_size > 0 else None
+        # Chunks of flushed queues posted in parallel over kept-alive connections, 0 leaves it to the librato client
+        self.submitter = Submitter(submit_concurrency, submit_gzip) if submit_concurrency > 0 else None
+        submit = self.submitter.submit if self.submitter else submit_chunks
+        # Flushed queues waiting to be submitted from a thread of their own, 0 submits on the flushing thread
+        self.sender = None
+        if spool_dir:
+            # Flushes wait on disk instead, until they're accepted, and are replayed after a restart
+            spool = Spool(spool_dir, spool_max_bytes, spool_max_age)
+            self.sender = Sender(submit, max_pending=send_queue_size or DEFAULT_MAX_PENDING, spool=spool,
+                                 new_queue=self._new_queue)
+        elif send_queue_size > 0:
+            self.sender = Sender(submit, max_pending=send_queue_size)
+        self._udp_drops = 0
+        # Kernel counters of the sockets of merged shards, summed
+        self.shard_udp_stats = None
         self._sock = None
+        self._timer = None
+        self._listeners = []
+        # Serializes ingestion from the UDP socket and stream connections
+        self._lock = threading.Lock()
+        # Guards recv_stats and queue_stats, which the receiver thread updates while the flush reads and resets them
+        self._stats_lock = threading.Lock()
         self.prefix = prefix
         if source_prefix:
             self.source = '{}-{}'.format(source_prefix, self.hostname)
         else:
             self.source = self.hostname
+        # Submit measurements with the tags of their context, rather than with the source only
+        self.tagged = tagged
+        self._tag_dicts = BoundedCache(self._make_tag_dict)
+        # Every flush is handed to each sink, on a worker of its own once the server is serving
+        self.sinks = [SinkWorker(self._create_sink(sink), sink_queue_size) for sink in sinks]
+
+    def _create_sink(self, sink):
+        """
+        :param sink: a Sink, or the name of a built-in sink, 'file:<path>' for the file sink and
+                     'prometheus:[<hostname>:]<port>' for the Prometheus endpoint
+        """
+        if isinstance(sink, Sink):
+            return sink
+        name, _, arg = sink.partition(':')
+        if name == LIBRATO:
+            return LibratoSink(self)
+        elif name == STDOUT:
+            return StdoutSink()
+        elif name == FILE and arg:
+            return FileSink(arg)
+        elif name == MEMORY:
+            return MemorySink()
+        elif name == PROMETHEUS and arg:
+            hostname, _, port = arg.rpartition(':')
+            return PrometheusSink(int(port), hostname)
+        raise ValueError("Unsupported sink: {}".format(sink))
 
     def process(self, data):
         # the data is a sequence of newline-delimited metrics
         # a metric is in the form "name:value|rest"  (rest may have more pipes)
         # <name>:<value>|<metric_type>|@<sample_rate>|#<tag1_name>:<tag1_value>,<tag2_name>:<tag2_value>:<value>
-        data.rstrip('\n')
-        metric_lines = data.split('\n')
+        # Returns the number of lines that were skipped
+        parse = self.parser.parse
+        errors = 0
 
-        for metric in metric_lines:
-            match = re.match('\A([^:]+):([^|]+)\|(.+)', metric)
+        for metric in data.split('\n'):
+            if not metric:
+                continue
 
-            if match is None:
+            parsed = parse(metric)
+            if parsed is None:
                 logger.warning("Skipping malformed metric: <%s>", metric)
+                errors += 1
                 continue
 
-            key = _clean_key(match.group(1))
-            value = match.group(2)
-            rest = match.group(3).split('|')
-            m_type = rest.pop(0)
+            key, value, m_type, rest, tags = parsed
+
+            # A bad line, e.g. with a value that isn't a number, only loses itself, not the lines after it
+            try:
+                if key == '_a':
+                    self.__record_alias(value, m_type)
+                elif m_type == 'ms':
+                    self.__record_timer(key, value, rest, tags)
+                elif m_type == 'g':
+                    self.__record_gauge(key, value, rest, tags)
+                elif m_type == 'c':
+                    self.__record_counter(key, value, rest, tags)
+                elif m_type == 's':
+                    self.__record_set(key, value, rest, tags)
+                elif m_type == 'h':
+                    self.__record_histogram(key, value, rest, tags)
+                else:
+                    logger.warning("Encountered unknown metric type in <%s>", metric)
+                    errors += 1
+            except Exception as error:
+                logger.warning("Skipping bad metric <%s>: %s", metric, error)
+                errors += 1
 
-            if key == '_a':
-                self.__record_alias(value, m_type)
-                return
+        return errors
 
-            tags = None
-            if rest and rest[-1][0] == '#':
-                tag_string = rest[-1][1:].lower()
-                tags = tuple(sorted([tuple(x.split(':')) for x in tag_string.split(',')]))
-                rest.pop()
-
-            if m_type == 'ms':
-                self.__record_timer(key, value, rest, tags)
-            elif m_type == 'g':
-                self.__record_gauge(key, value, rest, tags)
-            elif m_type == 'c':
-                self.__record_counter(key, value, rest, tags)
-            else:
-                logger.warning("Encountered unknown metric type in <%s>", metric)
+    def process_batch(self, payloads):
+        """Processes a batch of raw datagrams drained from the socket in a single wakeup.
+        Payloads that can't be decoded, and lines that can't be parsed, are logged and counted as errors.
+        """
+        errors = 0
+        with self._lock:
+            for data, addr in payloads:
+                try:
+                    errors += self.process(data.decode('UTF-8'))
+                except Exception as error:
+                    errors += 1
+                    logger.exception("Bad data from %s: %s", addr, error)
+
+        if errors:
+            with self._stats_lock:
+                self.recv_stats['errors'] += errors
+
+    def process_stream(self, data):
+        """Processes lines received over a TCP or Unix domain stream connection."""
+        with self._lock:
+            self.process(data)
 
     def __record_timer(self, key, value, rest, tags):
         ts = int(time.time())
-        timer = self.timers.setdefault(self.__make_context(key, tags), [[], ts])
-        timer[0].append(float(value or 0))
-        timer[1] = ts
+        sample_rate = self.__sample_rate(key, rest)
+        if not sample_rate:
+            return
+
+        sid = self.index.id_of(self.__make_context(key, tags))
+        bounds = self._key_buckets.get(key)
+        if bounds is not None:
+            self.generation.histograms.buffer(sid, ts, bounds).add(float(value or 0), 1 / sample_rate)
+            return
+        # Percentiles come from the sampled values, while the count is weighted by the sample rate
+        self.generation.timers.buffer(sid, ts).append(float(value or 0))
+        self.generation.timer_counts.add(sid, 1 / sample_rate, ts)
+
+    def _new_timer_values(self):
+        if self.timer_storage == TIMER_STORAGE_SKETCH:
+            return DDSketch(self.sketch_accuracy)
+        return summary.new_values()
 
     def __record_gauge(self, key, value, rest, tags):
         ts = int(time.time())
-        self.gauges[self.__make_context(key, tags)] = [float(value), ts]
+        sid = self.index.id_of(self.__make_context(key, tags))
+        gauges = self.generation.gauges
+        if value[0] not in '+-':
+            gauges.set(sid, float(value), ts)
+        elif gauges.get(sid) is not None:
+            # A delta following a value set in this interval
+            gauges.add(sid, float(value), ts)
+        else:
+            # A delta to the last value, which is applied at flush
+            self.generation.gauge_deltas.add(sid, float(value), ts)
 
     def __record_counter(self, key, value, rest, tags):
         ts = int(time.time())
-        sample_rate = 1.0
-        if len(rest) == 1:
-            sample_rate = float(re.match('^@([\d\.]+)', rest[0]).group(1))
-            if sample_rate == 0:
-                logger.warning("Ignoring counter with sample rate of zero: <%s>", key)
-                return
+        sample_rate = self.__sample_rate(key, rest)
+        if not sample_rate:
+            return
+
+        sid = self.index.id_of(self.__make_context(key, tags))
+        self.generation.counters.add(sid, float(value or 1) * (1 / sample_rate), ts)
+
+    def __record_set(self, key, value, rest, tags):
+        ts = int(time.time())
+        sid = self.index.id_of(self.__make_context(key, tags))
+        self.generation.sets.buffer(sid, ts).add(value)
+
+    def _new_set(self):
+        return HyperLogLog(self.set_precision)
+
+    def __record_histogram(self, key, value, rest, tags):
+        ts = int(time.time())
+        sample_rate = self.__sample_rate(key, rest)
+        if not sample_rate:
+            return
+
+        sid = self.index.id_of(self.__make_context(key, tags))
+        bounds = self._key_buckets.get(key) or self.histogram_buckets
+        self.generation.histograms.buffer(sid, ts, bounds).add(float(value or 0), 1 / sample_rate)
+
+    def __sample_rate(self, key, rest):
+        """
+        :return: the sample rate of a metric, 1.0 if it isn't sampled, or 0 if it should be ignored
+        """
+        if len(rest) != 1:
+            return 1.0
 
-        counter = self.counters.setdefault(self.__make_context(key, tags), [0, ts])
-        counter[0] += float(value or 1) * (1 / sample_rate)
-        counter[1] = ts
+        sample_rate = parse_sample_rate(rest[0])
+        if sample_rate == 0:
+            logger.warning("Ignoring metric with sample rate of zero: <%s>", key)
+        return sample_rate
 
     def __record_alias(self, alias, value):
         unescaped_value = value.replace('\\n', '\n')
@@ -190,142 +443,488 @@ class Server(object):
         self._set_timer()
 
     def flush(self):
+        snapshot, stats = self.build_snapshot()
+        for worker in self.sinks:
+            worker.send(snapshot)
+
+        if stats > 0:
+            logger.debug("\n====Flush completed. Waiting until next flush. Sent out %d metrics ====", stats)
+
+    def build_snapshot(self):
+        """Drains the aggregates into a snapshot of measurements, ready to be handed to the sinks.
+
+        :return: the snapshot and the number of stats it holds
+        """
         ts = int(math.floor(time.time()/self.flush_interval) * self.flush_interval)
         stats = 0
 
-        with self.api.new_queue() as queue:
-            stats += self._process_counters(queue, ts)
-            stats += self._process_gauges(queue, ts)
-            stats += self._process_timers(queue, ts)
+        # Ingestion carries on into a fresh generation while this one is processed
+        generation = self._swap_generation()
 
-            if stats > 0:
-                self._add_to_queue(queue, "statsd.numStats", stats, ts)
+        measurements = []
+        stats += self._process_counters(measurements, generation.counters)
+        stats += self._process_gauges(measurements, ts, generation.gauges, generation.gauge_deltas)
+        stats += self._process_timers(measurements, generation.timers, generation.timer_counts)
+        stats += self._process_sets(measurements, generation.sets)
+        stats += self._process_histograms(measurements, generation.histograms)
+        self._flushed.extend(self._series_of(generation))
 
         if stats > 0:
-            logger.debug("\n====Flush completed. Waiting until next flush. Sent out %d metrics ====", stats)
+            self._measure(measurements, "statsd.numStats", stats)
 
-    def _process_counters(self, queue, ts):
-        stats = 0
+        if self.index.max_series or self.index.max_series_per_metric:
+            self._measure(measurements, "statsd.series.count", len(self.index))
+            # New contexts that didn't get a series of their own, each counted once per interval
+            self._measure(measurements, "statsd.series.rejected", round(self.index.take_rejected().cardinality()))
 
-        # Make a copy of keys since dict can change
-        for context in list(self.counters):
-            (v, t) = self.counters[context]
+        if self.recv_batch > 0:
+            self._process_recv_stats(measurements)
 
-            # default to counter, no_aggregate_counters defaults to false
-            metric_type = "gauge" if self.no_aggregate_counters else "counter"
-            logger.debug("Sending %s => count=%s", context, v)
+        if self._queue:
+            self._process_queue_stats(measurements)
 
-            self._add_to_queue(queue, context[0] + ".count", v, ts, metric_type, tags=context[1])
+        if self.sender:
+            self._process_sender_stats(measurements)
 
-            # Clear the counter once the data is sent, if this is a counter as a gauge
-            if self.no_aggregate_counters:
-                del (self.counters[context])
-            stats += 1
+        if self.submitter:
+            self._process_submit_stats(measurements)
 
-        return stats
+        self._process_sink_stats(measurements)
 
-    def _process_gauges(self, queue, ts):
-        stats = 0
+        udp_stats = self.udp_stats()
+        if udp_stats:
+            self._process_udp_stats(measurements, udp_stats)
+
+        return Snapshot(ts, tuple(measurements)), stats
+
+    def queue_snapshot(self, snapshot):
+        """
+        :return: a queue of the measurements of a snapshot, ready to be submitted
+        """
+        queue = self._new_queue()
+        ts = snapshot.timestamp
+        for name, kind, value, tags in snapshot.measurements:
+            if kind == COUNTER:
+                self._add_to_queue(queue, name + ".count", value, ts, 'counter', tags=tags)
+            elif kind in (COUNT, SET):
+                self._add_to_queue(queue, name + ".count", value, ts, tags=tags)
+            elif kind == TIMER:
+                prefix = name + "."
+                self._add_to_queue(queue, prefix + "median", value.median, ts, tags=tags)
+                for pct, max_threshold in value.percentiles:
+                    self._add_to_queue(queue, prefix + percentile_suffix(pct), max_threshold, ts, tags=tags)
+                self._add_to_queue(queue, prefix + "count", value.weighted_count, ts, tags=tags)
+                self._add_gauge_to_queue(queue, prefix + "mean", value.mean, ts, count=value.count, min_=value.min,
+                                         max_=value.max, sum_=value.sum, sum_squares=value.sum_squares, tags=tags)
+            elif kind == HISTOGRAM:
+                prefix = name + "."
+                for bound, count in value:
+                    self._add_to_queue(queue, prefix + bucket_suffix(bound), count, ts, tags=tags)
+                self._add_to_queue(queue, prefix + "count", value[-1][1], ts, tags=tags)
+            elif kind == SUMMARY:
+                self._add_gauge_to_queue(queue, name, None, ts, count=value.count, min_=value.min, max_=value.max,
+                                         sum_=value.sum, sum_squares=value.sum_squares, tags=tags)
+            else:
+                self._add_to_queue(queue, name, value, ts, tags=tags)
+        return queue
 
-        # Make a copy of keys since dict can change
-        for context in list(self.gauges):
-            (v, t) = self.gauges[context]
+    def submit(self, queue):
+        if self.submitter:
+            self.submitter.submit(queue)
+        else:
+            queue.submit()
+
+    def _new_queue(self):
+        return self.api.new_queue()
+
+    def _swap_generation(self):
+        """Atomically replaces the generation being updated with an empty one, and forgets the series that were
+        flushed and hold nothing to report later, as well as expired series.
 
-            if self.expire > 0 and t + self.expire < ts:
-                logger.debug("Expiring gauge %s (age: %s)", context, ts - t)
-                del(self.gauges[context])
+        :return: the previous generation
+        """
+        with self._lock:
+            generation = self.generation
+            if self.expire > 0:
+                self._expire_series(generation)
+            # Series IDs are only reused while nothing else refers to them
+            self._free_series(generation)
+            # Sized for the live series, columns grow for IDs beyond them
+            self.generation = Generation(self._new_timer_values, self._new_set, Histogram, len(self.index))
+
+        if self.expire > 0:
+            last_seen = self.last_seen
+            for sid, t in generation.updates():
+                last_seen.touch(sid, t)
+        return generation
+
+    @staticmethod
+    def _series_of(generation):
+        """
+        :return: the IDs of the series updated in a generation
+        """
+        return list(set(sid for sid, _ in generation.updates()))
+
+    def _free_series(self, generation):
+        """Forgets the series of the last flush that weren't updated since, unless they hold a counter total, or
+        a gauge value that is still resent or that deltas apply to. Retained series are checked again at the next
+        swap. Timers, sets and histograms start from scratch every interval, so their series are only kept while
+        they're in use."""
+        now = int(time.time())
+        contexts = self.index.contexts
+        flushed, self._flushed = self._flushed, []
+        for sid in flushed:
+            if contexts[sid] is None or generation.updated(sid):
+                # Expired, or to be checked after the next flush
+                continue
+            if self._retained(sid, now):
+                self._flushed.append(sid)
+                continue
+            self._remove_series(sid)
+
+    def _retained(self, sid, now):
+        if not self.no_aggregate_counters and self.counter_totals.get(sid) is not None:
+            return True
+        gauge = self.gauge_values.get(sid)
+        if gauge is None:
+            return False
+        # Deltas apply to the last value, resent gauges are kept until their TTL has passed
+        return sid in self._delta_gauges or (self.gauge_ttl > 0 and gauge[1] + self.gauge_ttl >= now)
+
+    def _remove_series(self, sid):
+        self.counter_totals.clear(sid)
+        self.gauge_values.clear(sid)
+        self._delta_gauges.discard(sid)
+        self.index.remove(sid)
+
+    def _expire_series(self, generation):
+        now = int(time.time())
+        contexts = self.index.contexts
+
+        for sid in self.last_seen.expired(now - self.expire):
+            if contexts[sid] is None:
+                # Freed after its last flush
+                continue
+            if generation.updated(sid):
+                # Seen in the generation just swapped out, which hasn't been tracked yet
+                self.last_seen.touch(sid, now)
                 continue
 
+            logger.debug("Expiring %s (idle for over %ss)", contexts[sid], self.expire)
+            self._remove_series(sid)
+
+    def _process_counters(self, measurements, counters):
+        stats = 0
+        contexts = self.index.contexts
+
+        if self.no_aggregate_counters:
+            # Report the counts of this interval only
+            totals = counters
+            kind = COUNT
+        else:
+            # Report running totals of every counter seen so far
+            totals = self.counter_totals
+            kind = COUNTER
+            for sid, v, t in counters.items():
+                totals.add(sid, v, t)
+
+        for sid, v, t in totals.items():
+            context = contexts[sid]
+            logger.debug("Sending %s => count=%s", context, v)
+
+            self._measure(measurements, context[0], v, kind, context[1])
+            stats += 1
+
+        return stats
+
+    def _process_gauges(self, measurements, ts, gauges, gauge_deltas):
+        stats = 0
+        contexts = self.index.contexts
+        values = self.gauge_values
+
+        for sid, v, t in gauges.items():
+            values.set(sid, v, t)
+        for sid, delta, t in gauge_deltas.items():
+            # Kept as the base of the next deltas
+            self._delta_gauges.add(sid)
+            # Deltas received before a value was set in the same interval are superseded by it
+            if gauges.get(sid) is None:
+                last = values.get(sid)
+                values.set(sid, (last[0] if last else 0.0) + delta, t)
+
+        if self.gauge_ttl > 0:
+            # Resend every gauge updated within the TTL
+            updated = (item for item in values.items() if item[2] + self.gauge_ttl >= ts)
+        else:
+            updated = (item for item in values.items() if gauges.get(item[0]) or gauge_deltas.get(item[0]))
+
+        for sid, v, t in updated:
+            context = contexts[sid]
             v = float(v)
             logger.debug("Sending %s => value=%s", context, v)
 
-            self._add_to_queue(queue, context[0], v, ts, tags=context[1])
-            del(self.gauges[context])
+            self._measure(measurements, context[0], v, GAUGE, context[1])
             stats += 1
 
         return stats
 
-    def _process_timers(self, queue, ts):
+    def _process_timers(self, measurements, timers, timer_counts):
         stats = 0
+        contexts = self.index.contexts
 
-        # Create a copy of keys since the loop modifies the timers dict
-        for context in list(self.timers):
-            (v, t) = self.timers[context]
-            if self.expire > 0 and t + self.expire < ts:
-                logger.debug("Expiring timer %s (age: %s)", context, ts - t)
-                del(self.timers[context])
-                continue
-
+        for sid, v, t in timers.items():
+            context = contexts[sid]
             if len(v) > 0:
-                # Sort all the received values. We need it to extract percentiles
-                v.sort()
-                count = len(v)
-                min_ = v[0]
-                max_ = v[-1]
-
-                if count == 1:
-                    mean = min_
-                    max_threshold = max_
-                    median = min_
-                    total = min_
-                    sum_squares = min_ * min_
-                else:
-                    index = int(math.floor(count/2))
-                    if count % 2 == 0:
-                        median = (v[index] + v[index-1]) / 2
-                    else:
-                        median = v[index]
-                    index = int((self.pct_threshold / 100.0) * count)
-                    max_threshold = v[index - 1]
-                    total = sum(v)
-                    sum_squares = sum([i**2 for i in v])
-                    mean = total / count
-
-                del(self.timers[context])
-
-                logger.debug("Sending %s ====> lower=%s, mean=%s, upper=%s, %dpct=%s, count=%s",
-                             context, min_, mean, max_, self.pct_threshold, max_threshold, count)
-
-                prefix = context[0] + "."
-                self._add_to_queue(queue, prefix + "median", median, ts, tags=context[1])
-                self._add_to_queue(queue, prefix + "upper_" + str(self.pct_threshold), max_threshold, ts,
-                                   tags=context[1])
-                self._add_to_queue(queue, prefix + "count", count, ts, tags=context[1])
-                self._add_gauge_to_queue(queue, prefix + "mean", mean, ts, count=count,
-                                         min_=min_, max_=max_, sum_=total, sum_squares=sum_squares, tags=context[1])
+                percentiles = self._key_percentiles.get(context[0])
+                timer_summary = summary.summarize(v, percentiles, self.vectorize)
+                count, min_, max_, mean, median, thresholds, total, sum_squares = timer_summary
+                # The count of samples, scaled up by their sample rates
+                weighted = timer_counts.get(sid)
+                weighted_count = weighted[0] if weighted else count
+
+                logger.debug("Sending %s ====> lower=%s, mean=%s, upper=%s, %s, count=%s",
+                             context, min_, mean, max_, thresholds, weighted_count)
+
+                self._measure(measurements, context[0],
+                              TimerSummary(count, weighted_count, min_, max_, mean, median, tuple(thresholds), total,
+                                           sum_squares), TIMER, context[1])
                 # we only count this timer as a single stat even though we generated multiple measurements
                 stats += 1
 
         return stats
 
-    def _add_to_queue(self, queue, key, value, timestamp, metric_type='gauge', tags=None):
-        tags_dict = dict(tags) if tags else {}
-        if 'source' not in tags_dict:
-            tags_dict['source'] = self.source
-        metric = '{}.{}'.format(self.prefix, key) if self.prefix else key
-        queue.add(metric, value, metric_type, measure_time=timestamp, source=self.source)
+    def _process_sets(self, measurements, sets):
+        stats = 0
+        contexts = self.index.contexts
+
+        for sid, v, t in sets.items():
+            context = contexts[sid]
+            cardinality = round(v.cardinality())
+            logger.debug("Sending %s => cardinality=%s", context, cardinality)
+
+            self._measure(measurements, context[0], cardinality, SET, context[1])
+            stats += 1
+
+        return stats
+
+    def _process_histograms(self, measurements, histograms):
+        stats = 0
+        contexts = self.index.contexts
+
+        for sid, v, t in histograms.items():
+            context = contexts[sid]
+            buckets = tuple(v.cumulative())
+            logger.debug("Sending %s ====> %s", context, buckets)
+
+            self._measure(measurements, context[0], buckets, HISTOGRAM, context[1])
+            stats += 1
+
+        return stats
+
+    def _lookup_percentiles(self, key):
+        for prefix in self._prefixes:
+            if key.startswith(prefix):
+                return self.percentiles_by_prefix[prefix]
+        return self.percentiles
+
+    def _lookup_buckets(self, key):
+        for prefix in self._histogram_prefixes:
+            if key.startswith(prefix):
+                return self.histograms_by_prefix[prefix]
+        return None
+
+    @staticmethod
+    def _new_recv_stats():
+        return {'wakeups': 0, 'packets': 0, 'max_packets': 0, 'errors': 0}
+
+    def _process_recv_stats(self, measurements):
+        with self._stats_lock:
+            recv_stats, self.recv_stats = self.recv_stats, self._new_recv_stats()
+        wakeups = recv_stats['wakeups']
+
+        self._measure(measurements, "statsd.recv.packets", recv_stats['packets'])
+        self._measure(measurements, "statsd.recv.errors", recv_stats['errors'])
+        if wakeups > 0:
+            self._measure(measurements, "statsd.recv.packets_per_wakeup", float(recv_stats['packets']) / wakeups)
+            self._measure(measurements, "statsd.recv.max_packets_per_wakeup", recv_stats['max_packets'])
+
+    @staticmethod
+    def _new_queue_stats():
+        return {'drops': 0, 'max_depth': 0}
+
+    def _process_queue_stats(self, measurements):
+        with self._stats_lock:
+            queue_stats, self.queue_stats = self.queue_stats, self._new_queue_stats()
+
+        self._measure(measurements, "statsd.queue.depth", self._queue.qsize())
+        self._measure(measurements, "statsd.queue.max_depth", queue_stats['max_depth'])
+        self._measure(measurements, "statsd.queue.drops", queue_stats['drops'])
+
+    def _process_sender_stats(self, measurements):
+        sender_stats = self.sender.take_stats()
+
+        for name in ('pending', 'sent', 'retries', 'dropped', 'rejected'):
+            self._measure(measurements, "statsd.sender." + name, sender_stats[name])
+
+    def _process_submit_stats(self, measurements):
+        submit_stats = self.submitter.take_stats()
+
+        for name in ('chunks', 'errors', 'bytes', 'raw_bytes'):
+            self._measure(measurements, "statsd.submit." + name, submit_stats[name])
+        latency = submit_stats['latency']
+        if latency['count']:
+            self._measure(measurements, "statsd.submit.latency",
+                          GaugeSummary(latency['count'], latency['min'], latency['max'], latency['sum'],
+                                       latency['sum_squares']), SUMMARY)
+
+    def _process_sink_stats(self, measurements):
+        for worker in self.sinks:
+            # Sinks only fall behind, or drop snapshots, once they run on their own worker
+            if worker.running:
+                sink_stats = worker.take_stats()
+                for name in ('pending', 'sent', 'errors', 'dropped'):
+                    self._measure(measurements, "statsd.sink.{}.{}".format(worker.name, name), sink_stats[name])
+
+    def udp_stats(self):
+        """Reads the kernel's counters for the UDP socket.
+
+        :return: a dict with the bytes in the receive queue, the datagrams dropped since the last call and the
+            receive buffer size, or None if they aren't available on this platform
+        """
+        try:
+            inode = os.fstat(self._sock.fileno()).st_ino
+            rcvbuf = self._sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        except (AttributeError, OSError, socket.error):
+            # Not bound yet, or already closed
+            return None
+
+        entry = read_udp_socket_stats(inode)
+        if entry is None:
+            return None
+
+        rx_queue, drops = entry
+        drops, self._udp_drops = drops - self._udp_drops, drops
+        return {'rx_queue': rx_queue, 'drops': drops, 'rcvbuf': rcvbuf}
+
+    def _process_udp_stats(self, measurements, udp_stats):
+        self._measure(measurements, "statsd.udp.rx_queue", udp_stats['rx_queue'])
+        self._measure(measurements, "statsd.udp.drops", udp_stats['drops'])
+        self._measure(measurements, "statsd.udp.rcvbuf", udp_stats['rcvbuf'])
+
+    def _measure(self, measurements, key, value, kind=GAUGE, tags=()):
+        name = '{}.{}'.format(self.prefix, key) if self.prefix else key
+        measurements.append(Measurement(name, kind, value, tags))
+
+    def _add_to_queue(self, queue, metric, value, timestamp, metric_type='gauge', tags=None):
+        if self.tagged:
+            # Tagged measurements have no counter type, counters are sent as the counts of the interval
+            queue.add_tagged(metric, value, time=timestamp, tags=self._tag_dicts.get(tags or ()))
+        else:
+            queue.add(metric, value, metric_type, measure_time=timestamp, source=self.source)
         logger.debug("%s %s => %s", metric_type, metric, value)
 
-    def _add_gauge_to_queue(self, queue, key, value, timestamp, min_=None, max_=None, count=1,
+    def _add_gauge_to_queue(self, queue, metric, value, timestamp, min_=None, max_=None, count=1,
                             sum_=None, sum_squares=None, tags=None):
-        tags_dict = dict(tags) if tags else {}
+        if self.tagged:
+            queue.add_tagged(metric, sum_, time=timestamp, tags=self._tag_dicts.get(tags or ()),
+                             count=count, max=max_, min=min_, sum_squares=sum_squares)
+        else:
+            queue.add(metric, None, 'gauge', measure_time=timestamp,
+                      source=self.source, count=count, sum=sum_, max=max_, min=min_, sum_squares=sum_squares)
+        logger.debug("gauge %s => %s", metric, value)
+
+    def _make_tag_dict(self, tags):
+        """
+        :param tags: the tags of a context, as a tuple of (name, value) tuples
+        :return: the tags as the dict sent with tagged measurements, including the source unless it's a tag, shared
+                 by every measurement of every context with the same tags
+        """
+        tags_dict = {}
+        for tag in tags:
+            if len(tag) < 2:
+                # A tag without a value
+                continue
+            tags_dict[_intern(tag[0])] = _intern(':'.join(tag[1:]))
         if 'source' not in tags_dict:
             tags_dict['source'] = self.source
-        metric = '{}.{}'.format(self.prefix, key) if self.prefix else key
-        queue.add(metric, None, 'gauge', measure_time=timestamp,
-                  source=self.source, count=count, sum=sum_, max=max_, min=min_, sum_squares=sum_squares)
-        logger.debug("gauge %s => %s", metric, value)
+        return tags_dict
 
     def _set_timer(self):
         self._timer = threading.Timer(self.flush_interval, self.on_timer)
         self._timer.daemon = True
         self._timer.start()
 
-    def serve(self, hostname='localhost', port=8142):
+    def export_shard(self):
+        """Hands over everything aggregated since the last call, keyed by context, and starts a new generation."""
+        generation = self._swap_generation()
+        shard = generation.to_dicts(self.index)
+        # The parent keeps whatever outlives an interval, a shard's series are only kept while they're in use
+        self._flushed.extend(self._series_of(generation))
+        with self._stats_lock:
+            shard['recv_stats'], self.recv_stats = self.recv_stats, self._new_recv_stats()
+        shard['rejected'] = self.index.take_rejected()
+        shard['udp_stats'] = self.udp_stats()
+        return shard
+
+    def merge_shard(self, shard):
+        """Merges a shard produced by export_shard() into this server's aggregates."""
+        generation = self.generation
+        id_of = self.index.id_of
+
+        for context, (v, t) in shard['counters'].items():
+            sid = id_of(context)
+            counter = generation.counters.get(sid)
+            generation.counters.add(sid, v, max(counter[1], t) if counter else t)
+
+        for context, (v, t) in shard['gauges'].items():
+            sid = id_of(context)
+            gauge = generation.gauges.get(sid)
+            if gauge is None or gauge[1] <= t:
+                generation.gauges.set(sid, v, t)
+
+        for context, (v, t) in shard['gauge_deltas'].items():
+            sid = id_of(context)
+            if generation.gauges.get(sid) is not None:
+                generation.gauges.add(sid, v, t)
+            else:
+                generation.gauge_deltas.add(sid, v, t)
+
+        for context, (v, t) in shard['timers'].items():
+            generation.timers.buffer(id_of(context), t).extend(v)
+
+        for context, (v, t) in shard['timer_counts'].items():
+            generation.timer_counts.add(id_of(context), v, t)
+
+        for context, (v, t) in shard['sets'].items():
+            generation.sets.buffer(id_of(context), t).merge(v)
+
+        for context, (v, t) in shard['histograms'].items():
+            generation.histograms.buffer(id_of(context), t, v.bounds).merge(v)
+
+        self.index.rejected.merge(shard['rejected'])
+
+        with self._stats_lock:
+            for name, value in shard['recv_stats'].items():
+                if name == 'max_packets':
+                    self.recv_stats[name] = max(self.recv_stats[name], value)
+                else:
+                    self.recv_stats[name] += value
+
+        if shard['udp_stats']:
+            if self.shard_udp_stats is None:
+                self.shard_udp_stats = dict.fromkeys(shard['udp_stats'], 0)
+            for name, value in shard['udp_stats'].items():
+                self.shard_udp_stats[name] += value
+
+    def _bind(self, hostname, port, reuse_port=False):
         assert type(port) is int, 'port is not an integer: %s' % port
         addr = (hostname, port)
         try:
             self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if reuse_port:
+                self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            if self.rcvbuf > 0:
+                self._set_rcvbuf()
             self._sock.bind(addr)
         except socket.error as e:
             # kill my alter ego
@@ -337,6 +936,31 @@ class Server(object):
 
         logger.debug("StatsD Server listening on '%s' UDP port %d", hostname, port)
 
+    def start_listeners(self, hostname):
+        """Starts accepting newline-framed metrics on the configured TCP port and Unix domain socket."""
+        if self.tcp_port:
+            self._listeners.append(StreamListener.tcp(hostname, self.tcp_port, self.process_stream))
+        if self.unix_socket:
+            self._listeners.append(StreamListener.unix(self.unix_socket, self.process_stream))
+        for listener in self._listeners:
+            listener.start()
+
+    def _set_rcvbuf(self):
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        actual = self._sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        # Linux caps the requested size at net.core.rmem_max, then reports twice that for bookkeeping
+        granted = actual // 2 if sys.platform.startswith('linux') else actual
+        if granted < self.rcvbuf:
+            logger.warning("Requested a %d byte receive buffer but got %d, check net.core.rmem_max",
+                           self.rcvbuf, granted)
+        else:
+            logger.debug("Receive buffer is %d bytes", actual)
+
+    def serve(self, hostname='localhost', port=8142):
+        self._bind(hostname, port)
+        self.start_listeners(hostname)
+        self.start_sinks()
+
         def signal_handler(signal, frame):
             logger.debug("Stopping server...")
             self.stop()
@@ -347,20 +971,159 @@ class Server(object):
         self._set_timer()
 
         try:
-            while True:
-                data, addr = self._sock.recvfrom(self.buf)
+            if self._queue:
+                self._serve_pipelined()
+            elif self.recv_batch > 0:
+                self._serve_batched()
+            else:
+                self._serve_blocking()
+        except socket.error as e:
+            # Ignore interrupted system calls from sigterm.
+            if e.errno != socket.errno.EINTR:
+                raise
+
+    def _serve_blocking(self):
+        while True:
+            data, addr = self._sock.recvfrom(self.buf)
+            with self._lock:
                 try:
                     self.process(data.decode('UTF-8'))
                 except Exception as error:
                     logger.exception("Bad data from %s: %s", addr, error)
-        except socket.error as e:
-            # Ignore interrupted system calls from sigterm.
-            if e.errno != socket.errno.EINTR:
+
+    def _serve_batched(self):
+        """Waits for the socket to become readable, then drains up to recv_batch datagrams
+        with non-blocking reads and hands them to the parser as a single batch.
+        """
+        self._sock.setblocking(False)
+        while True:
+            select.select([self._sock], [], [])
+            self._receive_batch()
+
+    def _receive_batch(self):
+        payloads = self._read_batch()
+        if payloads:
+            self.process_batch(payloads)
+
+    def _read_batch(self):
+        payloads = self._drain()
+        if payloads:
+            with self._stats_lock:
+                recv_stats = self.recv_stats
+                recv_stats['wakeups'] += 1
+                recv_stats['packets'] += len(payloads)
+                if len(payloads) > recv_stats['max_packets']:
+                    recv_stats['max_packets'] = len(payloads)
+        return payloads
+
+    def _serve_pipelined(self):
+        """Receives datagrams on a dedicated thread, which hands them over through a bounded queue,
+        and parses them on this one. A slow parse stage fills the queue rather than the socket buffer.
+        """
+        if self.recv_batch > 0:
+            self._sock.setblocking(False)
+
+        receiver = threading.Thread(target=self._receive_into_queue, name='statsd-receiver')
+        receiver.daemon = True
+        receiver.start()
+
+        while True:
+            payloads = self._queue.get()
+            if payloads is None:
+                # The receiver stopped
+                return
+            self.process_batch(payloads)
+
+    def _receive_into_queue(self):
+        try:
+            while True:
+                if self.recv_batch > 0:
+                    select.select([self._sock], [], [])
+                    payloads = self._read_batch()
+                    if not payloads:
+                        continue
+                else:
+                    payloads = [self._sock.recvfrom(self.buf)]
+                self.enqueue(payloads)
+        except (socket.error, ValueError) as e:
+            # The socket was closed
+            logger.debug("StatsD receiver stopped: %s", e)
+        finally:
+            self._force_enqueue(None)
+
+    def enqueue(self, payloads):
+        """Hands a list of raw datagrams over to the parse stage, applying the overflow policy if the
+        queue is full.
+        """
+        if self.queue_policy == BLOCK:
+            self._queue.put(payloads)
+        else:
+            try:
+                self._queue.put_nowait(payloads)
+            except Queue.Full:
+                if self.queue_policy == DROP_NEWEST:
+                    self._count_drops(payloads)
+                    return
+                self._force_enqueue(payloads)
+
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            if depth > self.queue_stats['max_depth']:
+                self.queue_stats['max_depth'] = depth
+
+    def _force_enqueue(self, payloads):
+        """Makes room for the given payloads by dropping the oldest ones in the queue."""
+        while True:
+            try:
+                self._queue.put_nowait(payloads)
+                return
+            except Queue.Full:
+                try:
+                    dropped = self._queue.get_nowait()
+                    if dropped:
+                        self._count_drops(dropped)
+                except Queue.Empty:
+                    pass
+
+    def _count_drops(self, payloads):
+        with self._stats_lock:
+            self.queue_stats['drops'] += len(payloads)
+
+    def _drain(self):
+        payloads = []
+        while len(payloads) < self.recv_batch:
+            try:
+                payloads.append(self._sock.recvfrom(self.buf))
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
                 raise
+        return payloads
+
+    def start_sinks(self):
+        for worker in self.sinks:
+            worker.start()
+        if self.sender:
+            self.sender.start()
+
+    def stop_sinks(self):
+        """Stops the sinks once the pending snapshots are delivered, then the sender once they're submitted."""
+        for worker in self.sinks:
+            worker.stop()
+        if self.sender:
+            self.sender.stop()
+        if self.submitter:
+            self.submitter.close()
 
     def stop(self):
         self._timer.cancel()
+        for listener in self._listeners:
+            listener.stop()
         self._sock.close()
+        if self._queue:
+            # Wake up the parse stage
+            self._force_enqueue(None)
+        self.stop_sinks()
 
 
 class ServerDaemon(Daemon):
@@ -370,15 +1133,50 @@ class ServerDaemon(Daemon):
 
         logger.debug('Solarwinds StatsD Server for Librato account: "%s"', options.user)
 
-        server = Server(librato_user=options.user,
-                        librato_api_token=options.api_token,
-                        pct_threshold=options.pct,
-                        debug=options.debug,
-                        flush_interval=options.flush_interval,
-                        no_aggregate_counters=options.no_aggregate_counters,
-                        expire=options.expire,
-                        source_prefix=options.app_id,
-                        librato_hostname=options.metrics_hostname)
+        kwargs = {}
+        server_class = Server
+        if options.asyncio:
+            from .async_server import AsyncServer
+            server_class = AsyncServer
+        elif options.workers > 1:
+            from .workers import ShardedServer
+            server_class = ShardedServer
+            kwargs['workers'] = options.workers
+
+        server = server_class(librato_user=options.user,
+                              librato_api_token=options.api_token,
+                              pct_threshold=options.pct,
+                              debug=options.debug,
+                              flush_interval=options.flush_interval,
+                              no_aggregate_counters=options.no_aggregate_counters,
+                              expire=options.expire,
+                              source_prefix=options.app_id,
+                              librato_hostname=options.metrics_hostname,
+                              recv_batch=options.recv_batch,
+                              tcp_port=options.tcp_port,
+                              unix_socket=options.unix_socket,
+                              queue_size=options.queue_size,
+                              queue_policy=options.queue_policy,
+                              rcvbuf=options.rcvbuf,
+                              timer_storage=options.timer_storage,
+                              sketch_accuracy=options.sketch_accuracy,
+                              percentiles_by_prefix=options.pct_prefixes,
+                              set_precision=options.set_precision,
+                              histogram_buckets=options.histogram_buckets,
+                              histograms_by_prefix=options.histogram_prefixes,
+                              max_series=options.max_series,
+                              max_series_per_metric=options.max_series_per_metric,
+                              gauge_ttl=options.gauge_ttl,
+                              send_queue_size=options.send_queue_size,
+                              spool_dir=options.spool_dir,
+                              spool_max_bytes=options.spool_max_bytes,
+                              spool_max_age=options.spool_max_age,
+                              submit_concurrency=options.submit_concurrency,
+                              submit_gzip=not options.no_submit_gzip,
+                              tagged=options.tagged,
+                              sinks=options.sinks,
+                              sink_queue_size=options.sink_queue_size,
+                              **kwargs)
 
         server.serve(options.hostname, options.port)
 
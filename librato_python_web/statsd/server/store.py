@@ -0,0 +1,321 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Columnar storage of aggregates.
+
+Each (key, tags) context is assigned a dense integer series ID once, by the SeriesIndex. Aggregates then live in
+columns indexed by that ID rather than in dicts of small lists, so an update is an array write, a flush is a linear
+scan and each series costs a few machine words per column.
+"""
+
+from array import array
+from heapq import heappop, heappush
+
+from .hyperloglog import HyperLogLog
+
+# Smallest number of slots added when a column grows
+MIN_GROWTH = 64
+
+# Series over the caps of a SeriesIndex are folded into the (__overflow__, ()) series once the global cap is reached,
+# or into the series of their metric name tagged __overflow__:true once the cap of the metric name is reached
+OVERFLOW = '__overflow__'
+OVERFLOW_TAGS = ((OVERFLOW, 'true'),)
+
+# Rejected contexts are counted in 1024 registers, with a standard error of about 3%
+REJECTED_PRECISION = 10
+
+
+class SeriesIndex(object):
+    """Maps (key, tags) contexts to dense integer series IDs, and back.
+
+    The number of series can be capped, globally and per metric name, so that a client putting e.g. request IDs
+    in tags can't grow the aggregates without bound. New contexts over a cap share an overflow series instead.
+    """
+
+    def __init__(self, max_series=0, max_series_per_metric=0):
+        """
+        :param max_series: the maximum number of series, 0 for no limit
+        :param max_series_per_metric: the maximum number of tag combinations per metric name, 0 for no limit
+        """
+        self.ids = {}
+        # Contexts by series ID, None for the IDs of removed series, which are reused
+        self.contexts = []
+        # Heap of the IDs of removed series, the lowest is reused first to keep columns short
+        self.free = []
+        self.max_series = max_series
+        self.max_series_per_metric = max_series_per_metric
+        # Number of series of each metric name, kept when there's a cap per metric name
+        self.metric_series = {}
+        # Distinct new contexts folded into an overflow series since the last call to take_rejected()
+        self.rejected = HyperLogLog(REJECTED_PRECISION)
+
+    def __len__(self):
+        return len(self.contexts) - len(self.free)
+
+    def id_of(self, context):
+        """
+        :param context: a (key, tags) tuple
+        :return: the series ID of the context, assigned on first sight
+        """
+        sid = self.ids.get(context)
+        if sid is None:
+            sid = self._add(context)
+        return sid
+
+    def remove(self, sid):
+        """Forgets a series. Its ID is reused for the next new context."""
+        context = self.contexts[sid]
+        del self.ids[context]
+        self.contexts[sid] = None
+        heappush(self.free, sid)
+        # Overflow series don't count against the cap of their metric name
+        if context[1] != OVERFLOW_TAGS and context[0] in self.metric_series:
+            self.metric_series[context[0]] -= 1
+            if not self.metric_series[context[0]]:
+                del self.metric_series[context[0]]
+
+    def take_rejected(self):
+        """
+        :return: a HyperLogLog of the contexts folded into an overflow series since the last call
+        """
+        rejected, self.rejected = self.rejected, HyperLogLog(REJECTED_PRECISION)
+        return rejected
+
+    def _add(self, context):
+        if self.max_series and len(self) >= self.max_series:
+            self.rejected.add(repr(context))
+            return self._overflow((OVERFLOW, ()))
+
+        if self.max_series_per_metric:
+            key = context[0]
+            count = self.metric_series.get(key, 0)
+            if count >= self.max_series_per_metric:
+                self.rejected.add(repr(context))
+                return self._overflow((key, OVERFLOW_TAGS))
+            self.metric_series[key] = count + 1
+
+        return self._assign(context)
+
+    def _overflow(self, context):
+        sid = self.ids.get(context)
+        if sid is None:
+            sid = self._assign(context)
+        return sid
+
+    def _assign(self, context):
+        if self.free:
+            sid = heappop(self.free)
+            self.contexts[sid] = context
+        else:
+            sid = len(self.contexts)
+            self.contexts.append(context)
+        self.ids[context] = sid
+        return sid
+
+
+def _grown(size, needed):
+    return max(needed, size + max(size // 2, MIN_GROWTH))
+
+
+class ValueColumn(object):
+    """A float per series, and the time it was last updated, 0 for series that weren't updated."""
+
+    def __init__(self, size=0):
+        self.values = array('d', [0.0]) * size
+        self.stamps = array('l', [0]) * size
+
+    def __len__(self):
+        return len(self.stamps)
+
+    def grow(self, size):
+        extra = size - len(self.stamps)
+        if extra > 0:
+            self.values.extend(array('d', [0.0]) * extra)
+            self.stamps.extend(array('l', [0]) * extra)
+
+    def add(self, sid, value, ts):
+        if sid >= len(self.stamps):
+            self.grow(_grown(len(self.stamps), sid + 1))
+        self.values[sid] += value
+        self.stamps[sid] = ts
+
+    def set(self, sid, value, ts):
+        if sid >= len(self.stamps):
+            self.grow(_grown(len(self.stamps), sid + 1))
+        self.values[sid] = value
+        self.stamps[sid] = ts
+
+    def get(self, sid):
+        """
+        :return: a (value, ts) tuple, or None if the series wasn't updated
+        """
+        if sid < len(self.stamps) and self.stamps[sid]:
+            return self.values[sid], self.stamps[sid]
+        return None
+
+    def clear(self, sid):
+        if sid < len(self.stamps):
+            self.values[sid] = 0.0
+            self.stamps[sid] = 0
+
+    def items(self):
+        """Yields (sid, value, ts) for every updated series."""
+        values = self.values
+        for sid, ts in enumerate(self.stamps):
+            if ts:
+                yield sid, values[sid], ts
+
+
+class BufferColumn(object):
+    """A buffer of values per series, e.g. timer samples, created on first update."""
+
+    def __init__(self, factory, size=0):
+        self.factory = factory
+        self.buffers = [None] * size
+        self.stamps = array('l', [0]) * size
+
+    def __len__(self):
+        return len(self.stamps)
+
+    def grow(self, size):
+        extra = size - len(self.stamps)
+        if extra > 0:
+            self.buffers.extend([None] * extra)
+            self.stamps.extend(array('l', [0]) * extra)
+
+    def buffer(self, sid, ts, *args):
+        """
+        :param args: passed to the factory if the buffer has to be created
+        :return: the buffer of the series, marked as updated at ts
+        """
+        if sid >= len(self.stamps):
+            self.grow(_grown(len(self.stamps), sid + 1))
+        buf = self.buffers[sid]
+        if buf is None:
+            buf = self.buffers[sid] = self.factory(*args)
+        if ts > self.stamps[sid]:
+            self.stamps[sid] = ts
+        return buf
+
+    def get(self, sid):
+        """
+        :return: a (buffer, ts) tuple, or None if the series wasn't updated
+        """
+        if sid < len(self.stamps) and self.stamps[sid]:
+            return self.buffers[sid], self.stamps[sid]
+        return None
+
+    def items(self):
+        """Yields (sid, buffer, ts) for every updated series."""
+        buffers = self.buffers
+        for sid, ts in enumerate(self.stamps):
+            if ts:
+                yield sid, buffers[sid], ts
+
+
+class LastSeen(object):
+    """The time every series was last updated, with a heap ordering them so idle series are found without a scan.
+
+    The heap holds one entry per series, with the time it was last seen when the entry was pushed. Entries of
+    series seen since are only pushed back with their new time once they reach the top, so updates don't touch
+    the heap and finding the idle series costs O(log n) per series expired or refreshed.
+    """
+
+    def __init__(self):
+        # 0 for series that aren't tracked
+        self.stamps = array('l')
+        self.heap = []
+
+    def touch(self, sid, ts):
+        if sid >= len(self.stamps):
+            self.stamps.extend(array('l', [0]) * (_grown(len(self.stamps), sid + 1) - len(self.stamps)))
+        if not self.stamps[sid]:
+            heappush(self.heap, (ts, sid))
+        if ts > self.stamps[sid]:
+            self.stamps[sid] = ts
+
+    def expired(self, deadline):
+        """Yields the series last seen before deadline, which are no longer tracked."""
+        heap = self.heap
+        stamps = self.stamps
+        while heap and heap[0][0] < deadline:
+            ts, sid = heappop(heap)
+            if stamps[sid] >= deadline:
+                heappush(heap, (stamps[sid], sid))
+            else:
+                stamps[sid] = 0
+                yield sid
+
+
+class Generation(object):
+    """The counters, gauges, timers, sets and histograms aggregated during one flush interval."""
+
+    def __init__(self, timer_factory, set_factory, histogram_factory, size=0):
+        self.counters = ValueColumn(size)
+        self.gauges = ValueColumn(size)
+        # Sum of the +N/-N updates of gauges whose value wasn't set in the interval
+        self.gauge_deltas = ValueColumn(size)
+        self.timers = BufferColumn(timer_factory, size)
+        # Number of timer values, weighted by their sample rates
+        self.timer_counts = ValueColumn(size)
+        self.sets = BufferColumn(set_factory, size)
+        self.histograms = BufferColumn(histogram_factory, size)
+
+    def columns(self):
+        return (self.counters, self.gauges, self.gauge_deltas, self.timers, self.timer_counts, self.sets,
+                self.histograms)
+
+    def updated(self, sid):
+        """
+        :return: True if the series was updated in this generation
+        """
+        for column in self.columns():
+            if column.get(sid) is not None:
+                return True
+        return False
+
+    def updates(self):
+        """Yields (sid, ts) for every update of a series in this generation, possibly several per series."""
+        for column in self.columns():
+            for sid, _, ts in column.items():
+                yield sid, ts
+
+    def to_dicts(self, index):
+        """
+        :param index: the SeriesIndex the series IDs were assigned by
+        :return: the aggregates as dicts of context to [value, ts] for counters, gauges, gauge deltas,
+            timers, weighted timer counts, sets and histograms
+        """
+        contexts = index.contexts
+        return {
+            'counters': dict((contexts[sid], [v, t]) for sid, v, t in self.counters.items()),
+            'gauges': dict((contexts[sid], [v, t]) for sid, v, t in self.gauges.items()),
+            'gauge_deltas': dict((contexts[sid], [v, t]) for sid, v, t in self.gauge_deltas.items()),
+            'timers': dict((contexts[sid], [v, t]) for sid, v, t in self.timers.items()),
+            'timer_counts': dict((contexts[sid], [v, t]) for sid, v, t in self.timer_counts.items()),
+            'sets': dict((contexts[sid], [v, t]) for sid, v, t in self.sets.items()),
+            'histograms': dict((contexts[sid], [v, t]) for sid, v, t in self.histograms.items())
+        }
@@ -0,0 +1,152 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Newline-framed metric streams over TCP and Unix domain sockets.
+
+Local clients can stream metrics over a connection instead of sending datagrams, using the same line protocol
+understood by Server.process, without losing data when socket buffers overflow.
+"""
+
+import logging
+import os
+import socket
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from a connection at a time
+RECV_SIZE = 65536
+
+# Longest partial line buffered while waiting for its newline
+MAX_LINE_LENGTH = 65536
+
+
+class LineBuffer(object):
+    """Incrementally splits a byte stream into complete, newline-terminated lines."""
+
+    def __init__(self, max_line_length=MAX_LINE_LENGTH):
+        self.max_line_length = max_line_length
+        self.partial = b''
+
+    def feed(self, data):
+        """
+        Appends received bytes to the buffer.
+
+        :param data: the bytes read from the connection
+        :return: the complete lines received so far, joined by newlines, or None
+        """
+        end = data.rfind(b'\n')
+        if end < 0:
+            self.partial += data
+            if len(self.partial) > self.max_line_length:
+                logger.warning("Discarding %d bytes without a newline", len(self.partial))
+                self.partial = b''
+            return None
+
+        lines = self.partial + data[:end]
+        self.partial = data[end + 1:]
+        return lines
+
+    def close(self):
+        """
+        :return: the trailing line of a closed stream, if it wasn't terminated by a newline
+        """
+        lines, self.partial = self.partial, b''
+        return lines or None
+
+
+class StreamListener(object):
+    """Accepts stream connections on a background thread and serves each from its own thread."""
+
+    def __init__(self, sock, process, name):
+        self.sock = sock
+        self.process = process
+        self.name = name
+        self._thread = None
+
+    @classmethod
+    def tcp(cls, hostname, port, process):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((hostname, port))
+        sock.listen(socket.SOMAXCONN)
+        logger.debug("StatsD Server listening on '%s' TCP port %d", hostname, port)
+        return cls(sock, process, 'tcp:%s' % port)
+
+    @classmethod
+    def unix(cls, path, process):
+        if os.path.exists(path):
+            os.remove(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        sock.listen(socket.SOMAXCONN)
+        logger.debug("StatsD Server listening on unix socket %s", path)
+        return cls(sock, process, 'unix:%s' % path)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._accept, name='statsd-%s' % self.name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, addr = self.sock.accept()
+            except socket.error:
+                # The listening socket was closed
+                return
+            thread = threading.Thread(target=self._serve_connection, args=(conn, addr or self.name))
+            thread.daemon = True
+            thread.start()
+
+    def _serve_connection(self, conn, addr):
+        lines = LineBuffer()
+        try:
+            while True:
+                data = conn.recv(RECV_SIZE)
+                if not data:
+                    break
+                self._process(lines.feed(data), addr)
+            self._process(lines.close(), addr)
+        except socket.error as e:
+            logger.warning("Lost connection from %s: %s", addr, e)
+        finally:
+            conn.close()
+
+    def _process(self, data, addr):
+        if not data:
+            return
+        try:
+            self.process(data.decode('UTF-8'))
+        except Exception as error:
+            logger.exception("Bad data from %s: %s", addr, error)
+
+    def stop(self):
+        if self.sock.family == socket.AF_UNIX:
+            path = self.sock.getsockname()
+            if path and os.path.exists(path):
+                os.remove(path)
+        self.sock.close()
@@ -0,0 +1,255 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Parallel, compressed submission of flushed measurements.
+
+The librato client posts the chunks of a queue one after another, over a new connection each time. A Submitter posts
+them from a pool of threads instead, each keeping its connection to the API alive across chunks and flushes, with
+gzip'ed bodies, and records how long each chunk took and how many bytes it sent.
+"""
+
+import json
+import logging
+import socket
+import threading
+import time
+import zlib
+
+from librato import exceptions
+from six.moves import http_client
+from six.moves import queue as Queue
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 4
+
+# Seconds to wait for the API to respond to a chunk
+TIMEOUT = 10
+
+# zlib window bits producing a gzip header and trailer
+GZIP_WBITS = 31
+
+
+class SubmitError(IOError):
+    """The API failed to store a chunk, which can be retried."""
+
+
+class _Batch(object):
+    """The chunks of one queue, counted down as the submitting threads get through them."""
+
+    def __init__(self, size):
+        self.remaining = size
+        self.accepted = set()
+        self.error = None
+        self._cond = threading.Condition()
+
+    def done(self, index, error=None):
+        with self._cond:
+            if error is None:
+                self.accepted.add(index)
+            elif self.error is None:
+                self.error = error
+            self.remaining -= 1
+            if not self.remaining:
+                self._cond.notify_all()
+
+    def wait(self):
+        with self._cond:
+            while self.remaining:
+                self._cond.wait()
+
+
+class Submitter(object):
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, compress=True, timeout=TIMEOUT):
+        """
+        :param concurrency: the number of chunks in flight, each over a connection of its own
+        :param compress: gzip the bodies of the requests
+        :param timeout: the seconds to wait for the API to respond to a chunk
+        """
+        self.concurrency = concurrency
+        self.compress = compress
+        self.timeout = timeout
+        self.stats = self._new_stats()
+        self._stats_lock = threading.Lock()
+        self._chunks = Queue.Queue()
+        self._threads = []
+
+    @staticmethod
+    def _new_stats():
+        return {'chunks': 0, 'errors': 0, 'bytes': 0, 'raw_bytes': 0,
+                'latency': {'count': 0, 'sum': 0.0, 'min': None, 'max': None, 'sum_squares': 0.0}}
+
+    def take_stats(self):
+        """
+        :return: the number of chunks accepted and failed, the bytes sent and their size before compression, and a
+                 summary of the seconds the API took to respond to each chunk, since the last call
+        """
+        with self._stats_lock:
+            stats, self.stats = self.stats, self._new_stats()
+        return stats
+
+    def submit(self, queue):
+        """
+        Posts the chunks of a librato queue concurrently. Accepted chunks are removed from the queue, so a failed
+        submission can be retried without resending them.
+
+        :raise: the first error any chunk failed with, once every chunk was attempted
+        """
+        work = [('metrics', chunk) for chunk in queue.chunks] + \
+               [('measurements', chunk) for chunk in queue.tagged_chunks]
+        if not work:
+            return
+        if not self._threads:
+            self._start()
+
+        batch = _Batch(len(work))
+        for index, (path, chunk) in enumerate(work):
+            self._chunks.put((queue.connection, path, chunk, batch, index))
+        batch.wait()
+
+        legacy = len(queue.chunks)
+        queue.chunks = [chunk for i, chunk in enumerate(queue.chunks) if i not in batch.accepted]
+        queue.tagged_chunks = [chunk for i, chunk in enumerate(queue.tagged_chunks, legacy)
+                               if i not in batch.accepted]
+        if batch.error is not None:
+            raise batch.error
+
+    def close(self):
+        for _ in self._threads:
+            self._chunks.put(None)
+        self._threads = []
+
+    def _start(self):
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._run, name='statsd-submit-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        conn = None
+        while True:
+            work = self._chunks.get()
+            if work is None:
+                break
+
+            connection, path, chunk, batch, index = work
+            try:
+                conn, error = self._post(conn, connection, path, chunk)
+            except Exception as e:
+                # The connection was closed
+                conn, error = None, e
+            batch.done(index, error)
+
+        if conn is not None:
+            conn.close()
+
+    def _post(self, conn, connection, path, chunk):
+        """
+        Posts a chunk, over conn unless it's None.
+
+        :return: the connection to post the next chunk over, or None, and the error the API responded with, if any
+        """
+        body = json.dumps(chunk).encode('utf-8')
+        raw_bytes = len(body)
+        headers = connection._set_headers({'Content-Type': 'application/json'})
+        if self.compress:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS)
+            body = compressor.compress(body) + compressor.flush()
+            headers['Content-Encoding'] = 'gzip'
+
+        start = time.time()
+        reused = conn is not None
+        while True:
+            try:
+                if conn is None:
+                    conn = self._connect(connection)
+                conn.request('POST', connection.base_path + path, body, headers)
+                resp = conn.getresponse()
+                data = resp.read()
+                break
+            except Exception as e:
+                if conn is not None:
+                    conn.close()
+                    conn = None
+                if reused and _stale(e):
+                    # The API closed the kept-alive connection while it was idle, post once more over a new one
+                    logger.debug("Reconnecting to the API after %r", e)
+                    reused = False
+                    continue
+                self._record(error=True)
+                raise
+
+        if resp.getheader('connection', '').lower() == 'close':
+            conn.close()
+            conn = None
+
+        self._record(len(body), raw_bytes, time.time() - start, resp.status >= 400)
+        if resp.status >= 500:
+            return conn, SubmitError("{} from the API".format(resp.status))
+        elif resp.status >= 400:
+            return conn, _client_error(resp.status, data)
+        return conn, None
+
+    def _connect(self, connection):
+        if connection.protocol == 'https':
+            return http_client.HTTPSConnection(connection.hostname, timeout=self.timeout)
+        return http_client.HTTPConnection(connection.hostname, timeout=self.timeout)
+
+    def _record(self, sent=0, raw_bytes=0, latency=None, error=False):
+        with self._stats_lock:
+            stats = self.stats
+            if error:
+                stats['errors'] += 1
+            else:
+                stats['chunks'] += 1
+            stats['bytes'] += sent
+            stats['raw_bytes'] += raw_bytes
+            if latency is not None:
+                summary = stats['latency']
+                summary['count'] += 1
+                summary['sum'] += latency
+                summary['sum_squares'] += latency * latency
+                summary['min'] = latency if summary['min'] is None else min(summary['min'], latency)
+                summary['max'] = latency if summary['max'] is None else max(summary['max'], latency)
+
+
+def _stale(error):
+    """
+    :return: whether posting over a kept-alive connection failed because the other end had closed it
+    """
+    if isinstance(error, socket.timeout):
+        # The API may have received the chunk
+        return False
+    return isinstance(error, (socket.error, http_client.BadStatusLine))
+
+
+def _client_error(status, data):
+    try:
+        return exceptions.get(status, json.loads(data.decode('utf-8')))
+    except Exception:
+        # Not an error payload the librato client understands
+        return exceptions.get(status, data.decode('utf-8', 'replace'))
@@ -0,0 +1,124 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Summary statistics of timer values, computed at flush.
+
+Every summarize function returns a (count, min, max, mean, median, thresholds, sum, sum_squares) tuple, where
+thresholds lists a (pct, value) pair for each requested percentile.
+"""
+
+import math
+from array import array
+
+from .sketch import DDSketch
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Smaller timers are cheaper to summarize in pure python than to hand over to numpy
+VECTORIZE_MIN_VALUES = 64
+
+
+def new_values():
+    """
+    :return: an empty buffer for timer values. Values are stored as contiguous doubles, 8 bytes each, rather
+        than as a list of float objects.
+    """
+    return array('d')
+
+
+def summarize(v, percentiles, vectorize=True):
+    if isinstance(v, DDSketch):
+        return summarize_sketch(v, percentiles)
+    if vectorize and numpy is not None and isinstance(v, array) and len(v) >= VECTORIZE_MIN_VALUES:
+        return summarize_array(v, percentiles)
+    return summarize_values(v, percentiles)
+
+
+def summarize_sketch(v, percentiles):
+    quantiles = v.quantiles([0.5] + [pct / 100.0 for pct in percentiles])
+    thresholds = list(zip(percentiles, quantiles[1:]))
+    return v.count, v.min, v.max, v.sum / v.count, quantiles[0], thresholds, v.sum, v.sum_squares
+
+
+def summarize_values(v, percentiles):
+    # Sort all the received values. We need it to extract percentiles
+    if isinstance(v, list):
+        v.sort()
+    else:
+        v = sorted(v)
+    count = len(v)
+    min_ = v[0]
+    max_ = v[-1]
+
+    if count == 1:
+        mean = min_
+        thresholds = [(pct, max_) for pct in percentiles]
+        median = min_
+        total = min_
+        sum_squares = min_ * min_
+    else:
+        index = int(math.floor(count/2))
+        if count % 2 == 0:
+            median = (v[index] + v[index-1]) / 2
+        else:
+            median = v[index]
+        thresholds = [(pct, v[_threshold_index(pct, count)]) for pct in percentiles]
+        total = sum(v)
+        sum_squares = sum([i**2 for i in v])
+        mean = total / count
+
+    return count, min_, max_, mean, median, thresholds, total, sum_squares
+
+
+def summarize_array(v, percentiles):
+    """Vectorized equivalent of summarize_values for an array('d') of at least two values. Order statistics come
+    from a single partial sort (numpy.partition) of the array, in place, instead of a full sort.
+    """
+    a = numpy.frombuffer(v, dtype=numpy.float64)
+    count = len(a)
+
+    index = count // 2
+    kth = [0, count - 1, index] + [_threshold_index(pct, count) for pct in percentiles]
+    if count % 2 == 0:
+        kth.append(index - 1)
+    a.partition(sorted(set(kth)))
+
+    if count % 2 == 0:
+        median = (a[index] + a[index - 1]) / 2
+    else:
+        median = a[index]
+    thresholds = [(pct, float(a[_threshold_index(pct, count)])) for pct in percentiles]
+    total = float(a.sum())
+    sum_squares = float(numpy.dot(a, a))
+
+    return count, float(a[0]), float(a[-1]), total / count, float(median), thresholds, total, sum_squares
+
+
+def _threshold_index(pct, count):
+    return max(int((pct / 100.0) * count), 1) - 1
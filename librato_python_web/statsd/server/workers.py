@@ -0,0 +1,190 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Multi-process ingestion for the StatsD server.
+
+Worker processes bind the same UDP port with SO_REUSEPORT, so the kernel spreads datagrams across them. Each worker
+aggregates its own shard. At every flush interval the parent asks each worker for its shard and merges them before a
+single submission, so series are reported once and timer percentiles are computed over all samples.
+"""
+
+import logging
+import multiprocessing
+import select
+import signal
+import socket
+import threading
+import time
+
+from .statsd_server import Server
+
+logger = logging.getLogger(__name__)
+
+# Datagrams drained per wakeup by workers that weren't configured with --recv-batch
+DEFAULT_RECV_BATCH = 64
+
+
+class ShardedServer(Server):
+    def __init__(self, *args, **kwargs):
+        self.workers = kwargs.pop('workers', 2)
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise ValueError("SO_REUSEPORT is not supported on this platform")
+        # Workers are forked, the server holds a librato connection which can't be pickled for spawn or forkserver
+        try:
+            self._mp = multiprocessing.get_context('fork')
+        except AttributeError:
+            # python 2 always forks
+            self._mp = multiprocessing
+        except ValueError:
+            raise ValueError("StatsD workers need the fork start method, which is not supported on this platform")
+        super(ShardedServer, self).__init__(*args, **kwargs)
+        self.recv_batch = self.recv_batch or DEFAULT_RECV_BATCH
+        self._procs = []
+        self._conns = []
+        # Numbers flush requests, workers echo it with their shard so late replies aren't taken for current ones
+        self._flush_seq = 0
+        self._addr = None
+        self._stopped = threading.Event()
+
+    def start_workers(self, hostname, port):
+        self._addr = (hostname, port)
+        for i in range(self.workers):
+            proc, conn = self._start_worker()
+            self._procs.append(proc)
+            self._conns.append(conn)
+
+    def _start_worker(self):
+        conn, child_conn = self._mp.Pipe()
+        proc = self._mp.Process(target=self._run_worker, args=(child_conn,))
+        proc.daemon = True
+        proc.start()
+        return proc, conn
+
+    def _run_worker(self, conn):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        self._bind(self._addr[0], self._addr[1], reuse_port=True)
+        self._sock.setblocking(False)
+
+        # Flush requests are served from the receive loop, so a shard is never exported mid-update
+        while True:
+            readable, _, _ = select.select([self._sock, conn], [], [])
+            if conn in readable:
+                try:
+                    seq = conn.recv()
+                except EOFError:
+                    # The parent is gone
+                    return
+                conn.send((seq, self.export_shard()))
+            if self._sock in readable:
+                self._receive_batch()
+
+    def collect_shards(self, timeout=None):
+        """Requests a shard from every worker and merges the replies into this server's aggregates.
+        Replies that missed an earlier flush are merged as they're found, alongside the current ones.
+
+        :param timeout: the seconds to wait for all replies, half the flush interval by default
+        """
+        if timeout is None:
+            timeout = self.flush_interval / 2
+        deadline = time.time() + timeout
+        self._flush_seq += 1
+        seq = self._flush_seq
+
+        pending = []
+        for i, conn in enumerate(self._conns):
+            if not self._procs[i].is_alive():
+                logger.warning("StatsD worker %d exited with %s, restarting", i, self._procs[i].exitcode)
+                self._procs[i], self._conns[i] = self._start_worker()
+                continue
+            try:
+                # Late replies are merged before asking again, so they can't stand in for this one
+                while conn.poll(0):
+                    self._merge_reply(conn)
+                conn.send(seq)
+                pending.append(i)
+            except (EOFError, IOError) as e:
+                logger.warning("Lost StatsD worker %d: %s", i, e)
+
+        for i in pending:
+            conn = self._conns[i]
+            try:
+                while conn.poll(max(deadline - time.time(), 0)):
+                    if self._merge_reply(conn) == seq:
+                        break
+                else:
+                    logger.warning("StatsD worker %d didn't deliver its shard in time", i)
+            except (EOFError, IOError) as e:
+                logger.warning("Lost StatsD worker %d: %s", i, e)
+
+    def _merge_reply(self, conn):
+        """
+        :return: the number of the flush request the merged shard answered
+        """
+        seq, shard = conn.recv()
+        with self._lock:
+            self.merge_shard(shard)
+        return seq
+
+    def udp_stats(self):
+        udp_stats, self.shard_udp_stats = self.shard_udp_stats, None
+        return udp_stats
+
+    def flush(self):
+        self.collect_shards()
+        super(ShardedServer, self).flush()
+
+    def serve(self, hostname='localhost', port=8142):
+        self.start_workers(hostname, port)
+        # Stream connections are aggregated by the parent, alongside the merged shards
+        self.start_listeners(hostname)
+        self.start_sinks()
+        logger.debug("Started %d StatsD workers on '%s' UDP port %d", self.workers, hostname, port)
+
+        def signal_handler(signal, frame):
+            logger.debug("Stopping server...")
+            self.stop()
+
+        signal.signal(signal.SIGTERM, signal_handler)
+        signal.signal(signal.SIGINT, signal_handler)
+
+        self._set_timer()
+
+        # Wake up periodically so signals get delivered to the handler
+        while not self._stopped.is_set():
+            self._stopped.wait(1)
+
+    def stop(self):
+        self._stopped.set()
+        if self._timer:
+            self._timer.cancel()
+        for listener in self._listeners:
+            listener.stop()
+        for proc in self._procs:
+            if proc.is_alive():
+                proc.terminate()
+        self.stop_sinks()
@@ -47,8 +47,34 @@ config_options = [
     'metrics_hostname',
     'no_aggregate_counters',
     'pct',
+    'pct_prefixes',
+    'timer_storage',
+    'sketch_accuracy',
+    'set_precision',
+    'histogram_buckets',
+    'histogram_prefixes',
+    'max_series',
+    'max_series_per_metric',
+    'gauge_ttl',
+    'send_queue_size',
+    'spool_dir',
+    'spool_max_bytes',
+    'spool_max_age',
+    'submit_concurrency',
+    'no_submit_gzip',
+    'tagged',
+    'sinks',
+    'sink_queue_size',
     'pidfile',
     'port',
+    'recv_batch',
+    'rcvbuf',
+    'queue_size',
+    'queue_policy',
+    'tcp_port',
+    'unix_socket',
+    'workers',
+    'asyncio',
     'app_id',
     'restart',
     'stop',
@@ -69,7 +95,33 @@ defaults = {
     "hostname": "localhost",
     "pidfile": '/var/run/solarwinds-python-statsd.pid',
     "port": 8142,
+    "recv_batch": 0,
+    "rcvbuf": 0,
+    "queue_size": 0,
+    "queue_policy": "drop-newest",
+    "tcp_port": None,
+    "unix_socket": None,
+    "workers": 1,
+    "asyncio": False,
     "pct": 95,
+    "pct_prefixes": {},
+    "timer_storage": "list",
+    "sketch_accuracy": 0.01,
+    "set_precision": 12,
+    "histogram_buckets": [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000],
+    "histogram_prefixes": {},
+    "max_series": 0,
+    "max_series_per_metric": 0,
+    "gauge_ttl": 0,
+    "send_queue_size": 0,
+    "spool_dir": None,
+    "spool_max_bytes": 64 * 1024 * 1024,
+    "spool_max_age": 24 * 60 * 60,
+    "submit_concurrency": 0,
+    "no_submit_gzip": False,
+    "tagged": False,
+    "sinks": ["librato"],
+    "sink_queue_size": 10,
     "flush_interval": 60000,
     'no_aggregate_counters': False,
     'metrics_hostname': LIBRATO_HOSTNAME,
@@ -77,6 +129,43 @@ defaults = {
 }
 
 
+def percentile_list(value):
+    """ Parse a comma-separated list of percentiles, e.g. 50,90,99.9 """
+    try:
+        pcts = [float(pct) for pct in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid percentile list: {}'.format(value))
+    for pct in pcts:
+        if not 0 < pct <= 100:
+            raise argparse.ArgumentTypeError('percentile out of range: {}'.format(pct))
+    return [int(pct) if pct.is_integer() else pct for pct in pcts]
+
+
+def prefix_percentiles(value):
+    """ Parse a prefix=percentiles pair, e.g. app.db.=50,99 """
+    prefix, sep, pcts = value.rpartition('=')
+    if not sep or not prefix:
+        raise argparse.ArgumentTypeError('expected <prefix>=<percentiles>: {}'.format(value))
+    return prefix, percentile_list(pcts)
+
+
+def bucket_list(value):
+    """ Parse a comma-separated list of histogram bucket upper bounds, e.g. 10,50,100 """
+    try:
+        bounds = [float(bound) for bound in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid bucket list: {}'.format(value))
+    return [int(bound) if bound.is_integer() else bound for bound in bounds]
+
+
+def prefix_buckets(value):
+    """ Parse a prefix=buckets pair, e.g. app.api.=10,50,100 """
+    prefix, sep, bounds = value.rpartition('=')
+    if not sep or not prefix:
+        raise argparse.ArgumentTypeError('expected <prefix>=<buckets>: {}'.format(value))
+    return prefix, bucket_list(bounds)
+
+
 class _globals(object):
     config_path = "./agent-conf.json"
 
@@ -97,18 +186,82 @@ def load_config(args=sys.argv[1:], use_env=True):
     parser.add_argument('-c', '--create', help='create librato space (default: false)')
     parser.add_argument('-H', '--hostname', help='hostname to run on (default: localhost')
     parser.add_argument('-p', '--port', help='port to run on (default: 8142)', type=int)
+    parser.add_argument('--recv-batch',
+                        help='max datagrams drained from the socket per wakeup, 0 to read one at a time (default: 0)',
+                        type=int)
+    parser.add_argument('--queue-size',
+                        help='raw buffers queued between the receive and parse threads, 0 to parse on the receive '
+                             'thread (default: 0)', type=int)
+    parser.add_argument('--queue-policy', choices=['drop-newest', 'drop-oldest', 'block'],
+                        help='what to do with datagrams when the queue is full (default: drop-newest)')
+    parser.add_argument('--tcp-port', help='TCP port accepting newline-framed metrics (default: disabled)', type=int)
+    parser.add_argument('--unix-socket', help='unix domain socket path accepting newline-framed metrics '
+                                              '(default: disabled)')
+    parser.add_argument('--asyncio', action='store_true', default=None,
+                        help='serve from an asyncio event loop (python 3 only)')
+    parser.add_argument('--send-queue-size', type=int,
+                        help='flushes buffered for a sender thread that retries failed submissions, dropping the '
+                             'oldest when full, 0 submits from the flushing thread (default: 0)')
+    parser.add_argument('--spool-dir',
+                        help='directory flushes are spooled to until they are submitted, and replayed from after a '
+                             'restart (default: disabled)')
+    parser.add_argument('--spool-max-bytes', type=int,
+                        help='disk space of the spool, the oldest flushes are deleted beyond it (default: 64MB)')
+    parser.add_argument('--spool-max-age', type=int,
+                        help='seconds after which unsent flushes are deleted from the spool (default: 86400)')
+    parser.add_argument('--tagged', action='store_true', default=None,
+                        help='submit measurements with the tags they were sent with, through the measurements API, '
+                             'with counters reported per interval as with --no-aggregate-counters')
+    parser.add_argument('--submit-concurrency', type=int,
+                        help='chunks of measurements posted in parallel over kept-alive connections, 0 posts them '
+                             'one at a time through the librato client (default: 0)')
+    parser.add_argument('--no-submit-gzip', action='store_true', default=None,
+                        help='send uncompressed request bodies when posting chunks in parallel')
+    parser.add_argument('--sink', dest='sinks', action='append',
+                        help='where flushes are sent: librato, stdout, file:<path> for JSON lines or '
+                             'prometheus:[<host>:]<port> to serve /metrics (may be repeated, default: librato)')
+    parser.add_argument('--sink-queue-size', type=int,
+                        help='flushes buffered for each sink while it falls behind, dropping the oldest when full '
+                             '(default: 10)')
+    parser.add_argument('--rcvbuf', help='UDP receive buffer size in bytes, 0 for the system default (default: 0)',
+                        type=int)
+    parser.add_argument('--workers', help='number of processes sharing the port via SO_REUSEPORT (default: 1)',
+                        type=int)
     parser.add_argument('-u', '--user', dest='user', help='librato user email')
     parser.add_argument('--api-token', dest='api_token', help='librato api token')
     parser.add_argument('--flush-interval',
                         help='how often to send data to librato in milli-seconds (default: 60000)', type=int)
     parser.add_argument('--no-aggregate-counters',
                         help='should statsd report counters as absolute instead of count/sec', action='store_true')
-    parser.add_argument('-t', '--pct', help='stats pct threshold (default: 95)', type=int)
+    parser.add_argument('-t', '--pct', help='comma-separated stats pct thresholds (default: 95)',
+                        type=percentile_list)
+    parser.add_argument('--set-precision', type=int,
+                        help='sets estimate unique values in 2^precision registers, 4 to 16 (default: 12)')
+    parser.add_argument('--pct-prefix', dest='pct_prefixes', action='append', type=prefix_percentiles,
+                        help='pct thresholds for timers starting with a prefix, e.g. app.db.=50,99,99.9 '
+                             '(may be repeated)')
+    parser.add_argument('--histogram-buckets', type=bucket_list,
+                        help='comma-separated bucket upper bounds of |h metrics (default: 5,10,25,...,10000)')
+    parser.add_argument('--histogram-prefix', dest='histogram_prefixes', action='append', type=prefix_buckets,
+                        help='record timers starting with a prefix as histograms with the given buckets, '
+                             'e.g. app.api.=10,50,100 (may be repeated)')
+    parser.add_argument('--timer-storage', choices=['list', 'sketch'],
+                        help='keep every timer value, or a bounded-memory quantile sketch (default: list)')
+    parser.add_argument('--sketch-accuracy', help='relative accuracy of timer sketch quantiles (default: 0.01)',
+                        type=float)
+    parser.add_argument('--max-series', type=int,
+                        help='maximum number of distinct series, 0 for no limit (default: 0)')
+    parser.add_argument('--max-series-per-metric', type=int,
+                        help='maximum number of tag combinations per metric name, 0 for no limit (default: 0)')
     parser.add_argument('-D', '--daemon', dest='daemonize', action='store_true', help='daemonize')
     parser.add_argument('--pidfile', help='pid file')
     parser.add_argument('--restart', action='store_true', help='restart a running daemon')
     parser.add_argument('--stop', action='store_true', help='stop a running daemon')
-    parser.add_argument('--expire', help='time-to-live for old stats (in secs)', type=int)
+    parser.add_argument('--expire', type=int,
+                        help='forget series of any type, counters included, after this long without updates (in secs)')
+    parser.add_argument('--gauge-ttl', type=int,
+                        help='resend the last value of a gauge for this long after its last update (in secs), '
+                             '0 only sends updated gauges (default: 0)')
     parser.add_argument('--app-id', help='unique id for application')
     parser.add_argument('-M', '--metrics-hostname', help='Librato metrics API URL')
     parser.add_argument('-I', '--integration', help='Librato Python integration (django, flask or cherrypy)')
@@ -186,4 +339,8 @@ def validate_config(options):
         if not hasattr(options, key):
             errors.append('{} [{}] must be specified.'.format(key, desc))
 
+    if getattr(options, 'asyncio', False) and getattr(options, 'workers', 1) > 1:
+        # The asyncio server runs in a single process
+        errors.append('workers [number of processes] can\'t be combined with asyncio.')
+
     return len(errors) == 0, errors
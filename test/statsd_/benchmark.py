@@ -0,0 +1,117 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Micro-benchmarks for the StatsD server. They only print timings, so they are kept out of the test suite.
+
+Run from the test directory: python -m statsd_.benchmark
+"""
+from __future__ import print_function
+
+import random
+import sys
+import time
+from array import array
+
+from librato_python_web.statsd.server import summary
+from librato_python_web.statsd.server.parser import MetricParser
+from statsd_.test_parser import legacy_parse
+from statsd_.test_store import series_memory
+from statsd_.test_summary import PERCENTILES
+
+
+def parse_time():
+    lines = ['app.request %s/latency:%s|ms|#route:/users/%s,method:get' % (i % 500, i, i % 50)
+             for i in range(0, 5000)]
+    parser = MetricParser()
+
+    for label, parse in [('legacy', legacy_parse), ('parser', parser.parse)]:
+        t = time.time()
+        for _ in range(0, 20):
+            for line in lines:
+                parse(line)
+        print(label, 'lines/sec', int(len(lines) * 20 / (time.time() - t)))
+
+
+def summary_time():
+    if summary.numpy is None:
+        print('numpy is not installed, skipping the timer summary benchmark')
+        return
+
+    rnd = random.Random(42)
+    for size in (10, 100, 10000):
+        series = [[rnd.expovariate(0.01) for _ in range(size)] for _ in range(max(100000 // size, 10))]
+
+        lists = [list(values) for values in series]
+        t = time.time()
+        for values in lists:
+            summary.summarize_values(values, PERCENTILES)
+        print('pure python, %d values/timer: %.2f usec/timer' % (size, (time.time() - t) / len(lists) * 1e6))
+
+        arrays = [array('d', values) for values in series]
+        t = time.time()
+        for values in arrays:
+            summary.summarize_array(values, PERCENTILES)
+        print('numpy, %d values/timer: %.2f usec/timer' % (size, (time.time() - t) / len(arrays) * 1e6))
+
+
+def summary_memory():
+    if sys.version_info < (3, 4):
+        print('tracemalloc is not available, skipping the timer memory benchmark')
+        return
+
+    import tracemalloc
+    samples = 1000000
+
+    for label, values in [('list', []), ('array', summary.new_values())]:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for i in range(samples):
+            values.append(float(i))
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        print('%s: %.1f bytes/sample at %d samples' % (label, float(used) / samples, samples))
+
+
+def store_memory():
+    if sys.version_info < (3, 4):
+        print('tracemalloc is not available, skipping the series store benchmark')
+        return
+
+    series = 100000
+    dicts, columns = series_memory(series)
+    print('dict of lists: %.1f bytes/series, column: %.1f bytes/series' %
+          (float(dicts) / series, float(columns) / series))
+
+
+def main():
+    parse_time()
+    summary_time()
+    summary_memory()
+    store_memory()
+
+
+if __name__ == '__main__':
+    main()
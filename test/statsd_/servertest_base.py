@@ -0,0 +1,147 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import json
+import socket
+import threading
+import zlib
+
+from six.moves import BaseHTTPServer, socketserver
+
+from librato_python_web.statsd.server.statsd_server import Server
+
+
+class FakeQueue(object):
+    def __init__(self):
+        self.measurements = {}
+        self.tagged = []
+        self.submitted = False
+
+    def add(self, name, value, metric_type='gauge', **query_props):
+        self.measurements[name] = (value, metric_type, query_props)
+
+    def add_tagged(self, name, value, **query_props):
+        self.measurements[name] = (value, 'tagged', query_props)
+        self.tagged.append((name, value, query_props))
+
+    def submit(self):
+        self.submitted = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+
+class FakeApi(object):
+    def __init__(self):
+        self.queues = []
+
+    def new_queue(self):
+        queue = FakeQueue()
+        self.queues.append(queue)
+        return queue
+
+
+class FakeApiHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Keeps connections alive
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        # Connections idle for longer than this are closed, None keeps them open
+        self.timeout = self.server.idle_timeout
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.server.failures > 0:
+            # Hang up without a response
+            self.server.failures -= 1
+            self.close_connection = True
+            return
+
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = zlib.decompress(body, 31)
+        self.server.requests.append((self.path, json.loads(body.decode('utf-8'))))
+        self.server.clients.add(self.client_address)
+        self.send_response(self.server.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeApiServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A local stand-in for the metrics API, recording the (path, body) of the requests it accepts."""
+
+    daemon_threads = True
+
+    def __init__(self, failures=0, status=200, idle_timeout=None):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), FakeApiHandler)
+        self.idle_timeout = idle_timeout
+        self.requests = []
+        # Addresses of the connections requests were accepted on
+        self.clients = set()
+        self.status = status
+        # Number of requests hung up on before any is accepted
+        self.failures = failures
+        self.url = 'http://127.0.0.1:%d' % self.server_address[1]
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+def free_port(kind=socket.SOCK_STREAM):
+    """
+    :param kind: the socket type the port is picked for, SOCK_STREAM for TCP or SOCK_DGRAM for UDP
+    :return: a port on 127.0.0.1 that was free when it was picked
+    """
+    sock = socket.socket(socket.AF_INET, kind)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def make_server(**kwargs):
+    server = Server('user@example.com', 'token', **kwargs)
+    server.api = FakeApi()
+    return server
+
+
+def aggregates(server):
+    """
+    :return: the aggregates of the server's current generation, as dicts of context to [value, ts]
+    """
+    return server.generation.to_dicts(server.index)
@@ -0,0 +1,80 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import socket
+import sys
+import unittest
+
+from statsd_.servertest_base import FakeApi, aggregates, free_port
+
+
+@unittest.skipIf(sys.version_info < (3, 4), 'asyncio is not available')
+class AsyncServerTest(unittest.TestCase):
+    def setUp(self):
+        import asyncio
+        from librato_python_web.statsd.server.async_server import AsyncServer
+
+        self.asyncio = asyncio
+        self.loop = asyncio.new_event_loop()
+        self.server = AsyncServer('user@example.com', 'token', tcp_port=free_port())
+        self.server.api = FakeApi()
+        self.server.listen(self.loop, '127.0.0.1', 0)
+
+    def tearDown(self):
+        self.server.stop()
+        self.loop.run_forever()
+        self.loop.close()
+
+    def test_serve(self):
+        addr = self.server._sock.getsockname()
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client.sendto(b'foo:1|c\nbaz:10|ms', addr)
+        client.sendto(b'foo:2|c', addr)
+        client.close()
+        self.loop.run_until_complete(self.asyncio.sleep(0.1))
+
+        self.assertEqual(aggregates(self.server)['counters'][('foo', ())][0], 3)
+
+        self.server.on_timer()
+        queue = self.server.api.queues[-1]
+        self.assertTrue(queue.submitted)
+        self.assertEqual(queue.measurements['foo.count'][0], 3)
+        self.assertEqual(queue.measurements['baz.count'][0], 1)
+
+    def test_tcp(self):
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.connect(('127.0.0.1', self.server.tcp_port))
+        client.sendall(b'foo:1|c\nfoo:')
+        client.sendall(b'2|c\nbar:5|g')
+        client.close()
+        self.loop.run_until_complete(self.asyncio.sleep(0.1))
+
+        self.assertEqual(aggregates(self.server)['counters'][('foo', ())][0], 3)
+        self.assertEqual(aggregates(self.server)['gauges'][('bar', ())][0], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
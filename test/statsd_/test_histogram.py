@@ -0,0 +1,82 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import unittest
+
+from librato_python_web.statsd.server.histogram import Histogram, bucket_suffix
+from statsd_.servertest_base import aggregates, make_server
+
+
+class HistogramTest(unittest.TestCase):
+    def test_add(self):
+        histogram = Histogram((10, 50, 100))
+        for value in (1, 10, 10.5, 50, 99, 100, 101, 1000):
+            histogram.add(value)
+
+        self.assertEqual(list(histogram.counts), [2, 2, 2, 2])
+        self.assertEqual(histogram.cumulative(), [(10, 2), (50, 4), (100, 6), (None, 8)])
+        self.assertEqual(len(histogram), 8)
+
+    def test_merge(self):
+        a = Histogram((10, 50))
+        b = Histogram((10, 50))
+        a.add(5)
+        b.add(20)
+        b.add(60, 2)
+        a.merge(b)
+
+        self.assertEqual(list(a.counts), [1, 1, 2])
+        self.assertRaises(ValueError, a.merge, Histogram((10, 100)))
+
+    def test_bucket_suffix(self):
+        self.assertEqual(bucket_suffix(100), 'bucket_le_100')
+        self.assertEqual(bucket_suffix(2.5), 'bucket_le_2_5')
+        self.assertEqual(bucket_suffix(None), 'bucket_le_inf')
+
+    def test_server(self):
+        server = make_server(histogram_buckets=[100, 10], histograms_by_prefix={'api.': [250]})
+        server.process('db.query:5|h\ndb.query:20|h\ndb.query:200|h')
+        server.process('api.request:300|ms\napi.request:100|ms\nrender:30|ms')
+
+        histograms = aggregates(server)['histograms']
+        self.assertEqual(histograms[('db.query', ())][0].bounds, (10, 100))
+        self.assertEqual(histograms[('api.request', ())][0].bounds, (250,))
+        self.assertEqual(list(aggregates(server)['timers']), [('render', ())])
+
+        server.flush()
+        measurements = server.api.queues[-1].measurements
+        self.assertEqual(measurements['db.query.bucket_le_10'][0], 1)
+        self.assertEqual(measurements['db.query.bucket_le_100'][0], 2)
+        self.assertEqual(measurements['db.query.bucket_le_inf'][0], 3)
+        self.assertEqual(measurements['db.query.count'][0], 3)
+        self.assertEqual(measurements['api.request.bucket_le_250'][0], 1)
+        self.assertEqual(measurements['api.request.bucket_le_inf'][0], 2)
+        self.assertNotIn('api.request.median', measurements)
+        self.assertEqual(measurements['statsd.numStats'][0], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import unittest
+
+from librato_python_web.statsd.server.hyperloglog import HyperLogLog
+from statsd_.servertest_base import aggregates, make_server
+
+
+class HyperLogLogTest(unittest.TestCase):
+    def assertEstimates(self, hll, expected, error):
+        self.assertLessEqual(abs(hll.cardinality() - expected), error * expected, hll.cardinality())
+
+    def test_cardinality(self):
+        for n in (100, 1000, 100000):
+            hll = HyperLogLog()
+            for i in range(n):
+                hll.add('user-{}'.format(i))
+                hll.add('user-{}'.format(i))
+            # Roughly 3 standard errors
+            self.assertEstimates(hll, n, 0.05)
+
+    def test_empty(self):
+        self.assertEqual(HyperLogLog().cardinality(), 0)
+
+    def test_merge(self):
+        a = HyperLogLog()
+        b = HyperLogLog()
+        for i in range(20000):
+            a.add(str(i))
+        for i in range(10000, 30000):
+            b.add(str(i))
+        a.merge(b)
+
+        self.assertEstimates(a, 30000, 0.05)
+
+    def test_precision(self):
+        self.assertRaises(ValueError, HyperLogLog, 3)
+        self.assertRaises(ValueError, HyperLogLog, 17)
+        self.assertRaises(ValueError, HyperLogLog(10).merge, HyperLogLog(12))
+
+    def test_server(self):
+        server = make_server(set_precision=10)
+        server.process('users:alice|s\nusers:bob|s\nlogins:alice|s|#region:us')
+        server.process('users:carol|s')
+
+        sets = aggregates(server)['sets']
+        self.assertEqual(round(sets[('users', ())][0].cardinality()), 3)
+
+        server.flush()
+        measurements = server.api.queues[-1].measurements
+        self.assertEqual(measurements['users.count'][0], 3)
+        self.assertEqual(measurements['logins.count'][0], 1)
+        self.assertEqual(measurements['statsd.numStats'][0], 2)
+        self.assertEqual(aggregates(server)['sets'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import re
+import unittest
+
+from librato_python_web.statsd.server.parser import BoundedCache, MetricParser, clean_key
+
+
+def legacy_parse(line):
+    """The regex-per-line parser Server.process used before MetricParser, kept for comparison."""
+    match = re.match('\\A([^:]+):([^|]+)\\|(.+)', line)
+    if match is None:
+        return None
+
+    key = re.sub(r'[^a-zA-Z_\-0-9\.]', '', re.sub(r'\s+', '_', match.group(1).replace('/', '-').replace(' ', '_')))
+    value = match.group(2)
+    rest = match.group(3).split('|')
+    m_type = rest.pop(0)
+
+    tags = None
+    if rest and rest[-1][0] == '#':
+        tag_string = rest[-1][1:].lower()
+        tags = tuple(sorted([tuple(x.split(':')) for x in tag_string.split(',')]))
+        rest.pop()
+
+    return key, value, m_type, rest, tags
+
+
+LINES = [
+    'foo:1|c',
+    'foo.bar:1|c|@0.1',
+    'web request/latency:12.5|ms|#Route:/users,method:GET',
+    'queue depth:42|g|#queue:jobs',
+    'foo::1|c',
+    'a:b:c|g',
+    'foo:1|ms|@0.5|#a:1,b:2',
+]
+
+MALFORMED = ['foo', 'foo:1', 'foo:1|', ':1|c', 'foo:|c']
+
+
+class ParserTest(unittest.TestCase):
+    def test_parse(self):
+        parser = MetricParser()
+        for line in LINES:
+            self.assertEqual(legacy_parse(line), parser.parse(line), line)
+            # second pass comes from the memo
+            self.assertEqual(legacy_parse(line), parser.parse(line), line)
+
+    def test_malformed(self):
+        parser = MetricParser()
+        for line in MALFORMED:
+            self.assertIsNone(parser.parse(line), line)
+
+    def test_clean_key(self):
+        self.assertEqual(clean_key('web request/latency\t(ms)'), 'web_request-latency_ms')
+
+    def test_bounded_cache(self):
+        cache = BoundedCache(clean_key, 10)
+        for i in range(0, 11):
+            cache.get('foo %s' % i)
+
+        # White box test... is oldest entry in cache
+        self.assertNotIn('foo 0', cache.cache)
+        self.assertIn('foo 1', cache.cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
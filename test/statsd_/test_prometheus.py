@@ -0,0 +1,119 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import unittest
+
+from six.moves.urllib.error import HTTPError
+from six.moves.urllib.request import urlopen
+
+from librato_python_web.statsd.server.prometheus import Renderer
+from librato_python_web.statsd.server.snapshot import (COUNTER, GAUGE, HISTOGRAM, TIMER, Measurement, Snapshot,
+                                                       TimerSummary)
+from statsd_.servertest_base import make_server
+
+
+class RendererTest(unittest.TestCase):
+    def test_render(self):
+        timer = TimerSummary(2, 4.0, 10.0, 20.0, 15.0, 15.0, ((50, 15.0), (99.9, 20.0)), 30.0, 500.0)
+        snapshot = Snapshot(0, (
+            Measurement('api.requests', COUNTER, 3, (('region', 'us'),)),
+            Measurement('3xx-rate', GAUGE, 0.5, (('path', '/a"b\\c'), ('flag',))),
+            Measurement('db.query', TIMER, timer, ()),
+            Measurement('api.requests', COUNTER, 4, (('region', 'eu'),)),
+            Measurement('size', HISTOGRAM, ((100, 1), (None, 2)), ()),
+        ))
+
+        self.assertEqual(Renderer().render(snapshot).decode('utf-8').splitlines(), [
+            '# TYPE api_requests_total counter',
+            'api_requests_total{region="us"} 3.0',
+            'api_requests_total{region="eu"} 4.0',
+            '# TYPE _3xx_rate gauge',
+            '_3xx_rate{path="/a\\"b\\\\c"} 0.5',
+            '# TYPE db_query summary',
+            'db_query{quantile="0.5"} 15.0',
+            'db_query{quantile="0.999"} 20.0',
+            # Scaled up by the sample rate, like the count
+            'db_query_sum 60.0',
+            'db_query_count 4.0',
+            '# TYPE size histogram',
+            'size_bucket{le="100.0"} 1.0',
+            'size_bucket{le="+Inf"} 2.0',
+            'size_count 2.0',
+        ])
+
+    def test_empty(self):
+        self.assertEqual(Renderer().render(Snapshot(0, ())), b'')
+
+
+class PrometheusSinkTest(unittest.TestCase):
+    def setUp(self):
+        self.server = make_server(sinks=['prometheus:127.0.0.1:0'], pct_threshold=[90])
+        sink = self.server.sinks[0].sink
+        # Nothing is bound until the server starts
+        self.assertIsNone(sink.httpd)
+        # The endpoint is served while the worker stays idle, so flushes are delivered before they return
+        sink.start()
+        self.url = 'http://127.0.0.1:%d' % sink.port
+
+    def tearDown(self):
+        self.server.stop_sinks()
+
+    def scrape(self, path='/metrics'):
+        response = urlopen(self.url + path, timeout=5)
+        try:
+            self.assertEqual(response.headers['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+            return response.read().decode('utf-8').splitlines()
+        finally:
+            response.close()
+
+    def test_scrape(self):
+        self.assertEqual(self.scrape(), [])
+
+        self.server.process('foo:1|c|#region:us\nbar:2.5|g\nbaz:10|ms\nbaz:20|ms')
+        self.server.flush()
+        lines = self.scrape()
+        self.assertIn('foo_total{region="us"} 1.0', lines)
+        self.assertIn('bar 2.5', lines)
+        self.assertIn('baz{quantile="0.9"} 10.0', lines)
+        self.assertIn('baz_count 2.0', lines)
+        self.assertIn('statsd_numStats 3.0', lines)
+        # Nothing went to the metrics API
+        self.assertEqual(self.server.api.queues, [])
+
+        # Scrapes are served the last flush until the next one
+        self.server.process('bar:5|g')
+        self.assertEqual(self.scrape(), lines)
+        self.server.flush()
+        self.assertIn('bar 5.0', self.scrape())
+
+    def test_not_found(self):
+        with self.assertRaises(HTTPError) as context:
+            self.scrape('/')
+        self.assertEqual(context.exception.code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import unittest
+
+from librato.exceptions import BadRequest, ClientError
+
+from librato_python_web.statsd.server.sender import Sender
+from librato_python_web.statsd.server.statsd_server import Server
+from statsd_.servertest_base import FakeApiServer, FakeQueue
+
+
+class SenderTest(unittest.TestCase):
+    def setUp(self):
+        self.submitted = []
+        self.failures = 0
+        self.sender = Sender(self.submit, max_pending=3, retry_initial=0.01, retry_max=0.02)
+
+    def tearDown(self):
+        self.sender.stop()
+
+    def submit(self, queue):
+        if self.failures > 0:
+            self.failures -= 1
+            raise IOError('connection refused')
+        queue.submit()
+        self.submitted.append(queue)
+
+    def test_retry(self):
+        self.failures = 3
+        queues = [FakeQueue() for _ in range(2)]
+        for queue in queues:
+            self.sender.send(queue)
+        self.sender.start()
+        self.sender.stop(timeout=5)
+
+        self.assertEqual(self.submitted, queues)
+        stats = self.sender.take_stats()
+        self.assertEqual((stats['sent'], stats['retries'], stats['pending']), (2, 3, 0))
+
+    def test_drop_oldest(self):
+        queues = [FakeQueue() for _ in range(5)]
+        for queue in queues:
+            self.sender.send(queue)
+        self.sender.start()
+        self.sender.stop(timeout=5)
+
+        self.assertEqual(self.submitted, queues[2:])
+        self.assertEqual(self.sender.take_stats()['dropped'], 2)
+
+    def test_rejected(self):
+        def reject(queue):
+            raise BadRequest()
+
+        self.sender.submit = reject
+        self.sender.send(FakeQueue())
+        self.sender.start()
+        self.sender.stop(timeout=5)
+
+        self.assertEqual(self.sender.take_stats()['rejected'], 1)
+
+    def test_rate_limited(self):
+        responses = [ClientError(429, {'error': 'You have hit the API limit'}), ClientError(408)]
+
+        def throttle(queue):
+            if responses:
+                raise responses.pop(0)
+            self.submitted.append(queue)
+
+        self.sender.submit = throttle
+        queue = FakeQueue()
+        self.sender.send(queue)
+        self.sender.start()
+        self.sender.stop(timeout=5)
+
+        self.assertEqual(self.submitted, [queue])
+        stats = self.sender.take_stats()
+        self.assertEqual((stats['sent'], stats['retries'], stats['rejected']), (1, 2, 0))
+
+
+class HttpSenderTest(unittest.TestCase):
+    def setUp(self):
+        self.api = FakeApiServer(failures=2)
+
+    def tearDown(self):
+        self.api.close()
+
+    def test_submit(self):
+        server = Server('user@example.com', 'token', send_queue_size=4,
+                        librato_hostname=self.api.url)
+        server.sender.retry_initial = 0.01
+        server.sender.start()
+        server.process('foo:1|c\nbar:2|g')
+        server.flush()
+        server.sender.stop(timeout=5)
+
+        self.assertEqual(len(self.api.requests), 1)
+        path, body = self.api.requests[0]
+        self.assertEqual(path, '/v1/metrics')
+        self.assertEqual(sorted(m['name'] for m in body['counters'] + body['gauges']),
+                         ['bar', 'foo.count', 'statsd.numStats', 'statsd.sender.dropped', 'statsd.sender.pending',
+                          'statsd.sender.rejected', 'statsd.sender.retries', 'statsd.sender.sent'])
+        self.assertEqual(server.sender.take_stats()['retries'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
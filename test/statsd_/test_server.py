@@ -0,0 +1,408 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from librato_python_web.statsd.client.statsd_client import Client
+from librato_python_web.statsd.server.statsd_server import read_udp_socket_stats
+from librato_python_web.statsd.server.streams import LineBuffer
+from statsd_.servertest_base import aggregates, make_server
+
+
+class ServerTest(unittest.TestCase):
+    def test_process(self):
+        server = make_server()
+        server.process('foo:1|c\nbar:2.5|g\nbaz:10|ms\nbaz:20|ms')
+
+        self.assertEqual(aggregates(server)['counters'][('foo', ())][0], 1)
+        self.assertEqual(aggregates(server)['gauges'][('bar', ())][0], 2.5)
+        self.assertEqual(list(aggregates(server)['timers'][('baz', ())][0]), [10.0, 20.0])
+
+    def test_flush(self):
+        server = make_server()
+        server.process('foo:1|c\nbar:2.5|g\nbaz:10|ms\nbaz:20|ms')
+        server.flush()
+
+        measurements = server.api.queues[-1].measurements
+        self.assertEqual(measurements['foo.count'][0], 1)
+        self.assertEqual(measurements['bar'][0], 2.5)
+        self.assertEqual(measurements['baz.median'][0], 15)
+        self.assertEqual(measurements['baz.count'][0], 2)
+        self.assertEqual(measurements['statsd.numStats'][0], 3)
+
+    def test_counter_totals(self):
+        server = make_server()
+        server.process('foo:1|c')
+        server.flush()
+        server.process('foo:2|c')
+        server.flush()
+
+        self.assertEqual(aggregates(server)['counters'], {})
+        self.assertEqual(server.api.queues[-1].measurements['foo.count'][:2], (3, 'counter'))
+
+    def test_flush_during_ingestion(self):
+        server = make_server(no_aggregate_counters=True)
+        total = 20000
+
+        def ingest():
+            for _ in range(total):
+                server.process_stream('foo:1|c')
+
+        thread = threading.Thread(target=ingest)
+        thread.start()
+        while thread.is_alive():
+            server.flush()
+        thread.join()
+        server.flush()
+
+        # Every update lands in exactly one generation
+        counts = [q.measurements['foo.count'][0] for q in server.api.queues if 'foo.count' in q.measurements]
+        self.assertEqual(sum(counts), total)
+
+    def test_percentiles(self):
+        server = make_server(pct_threshold=[99.9, 50, 90], percentiles_by_prefix={'db.': [99], 'db.slow.': [75]})
+        server.process('\n'.join('%s:%d|ms' % (key, i) for key in ('web', 'db.query', 'db.slow.query')
+                                 for i in range(1, 1001)))
+        server.flush()
+
+        measurements = server.api.queues[-1].measurements
+        self.assertEqual(measurements['web.upper_50'][0], 500)
+        self.assertEqual(measurements['web.upper_90'][0], 900)
+        self.assertEqual(measurements['web.upper_99_9'][0], 999)
+        self.assertEqual(measurements['db.query.upper_99'][0], 990)
+        self.assertNotIn('db.query.upper_90', measurements)
+        self.assertEqual(measurements['db.slow.query.upper_75'][0], 750)
+
+    def test_small_percentile(self):
+        server = make_server(pct_threshold=[1])
+        server.process('foo:1|ms\nfoo:2|ms')
+        server.flush()
+
+        self.assertEqual(server.api.queues[-1].measurements['foo.upper_1'][0], 1)
+
+    def test_sample_rate(self):
+        server = make_server(histograms_by_prefix={'api.': [100]})
+        server.process('foo:10|ms|@0.1\nfoo:20|ms|@0.1\nfoo:30|ms\nbar:5|g|@0.5\napi.request:50|ms|@0.25\n'
+                       'foo:40|ms|@0')
+        server.flush()
+
+        measurements = server.api.queues[-1].measurements
+        self.assertEqual(measurements['foo.count'][0], 21)
+        self.assertEqual(measurements['foo.median'][0], 20)
+        self.assertEqual(measurements['foo.mean'][2]['count'], 3)
+        self.assertEqual(measurements['bar'][0], 5)
+        self.assertEqual(measurements['api.request.bucket_le_100'][0], 4)
+
+        # Metrics that are ignored don't take a series ID
+        series = len(server.index)
+        server.process('ignored.timer:1|ms|@0\nignored.counter:1|c|@0\nignored.histogram:1|h|@0')
+        self.assertEqual(len(server.index), series)
+
+    def test_gauge_deltas(self):
+        server = make_server()
+        server.process('depth:+5|g\ndepth:-2|g\nsize:+1|g\nsize:10|g\nsize:+2|g')
+        server.flush()
+        server.process('depth:+4|g')
+        server.flush()
+        server.flush()
+
+        first, second, third = [q.measurements for q in server.api.queues]
+        self.assertEqual(first['depth'][0], 3)
+        self.assertEqual(first['size'][0], 12)
+        self.assertEqual(second['depth'][0], 7)
+        self.assertNotIn('size', second)
+        self.assertNotIn('depth', third)
+
+    def test_client_negative_gauge(self):
+        server = make_server()
+        server._bind('127.0.0.1', 0)
+        self.addCleanup(server._sock.close)
+        client = Client('127.0.0.1', server._sock.getsockname()[1])
+        self.addCleanup(client.udp_sock.close)
+
+        for _ in range(2):
+            client.gauge('temp', -5)
+            client.gauge('depth', -2, tags={'queue': 'jobs'})
+            for _ in range(2):
+                self.server_receive(server)
+            server.flush()
+
+        for queue in server.api.queues:
+            self.assertEqual(queue.measurements['temp'][0], -5)
+            self.assertEqual(queue.measurements['depth'][0], -2)
+
+    @staticmethod
+    def server_receive(server):
+        data, addr = server._sock.recvfrom(server.buf)
+        server.process(data.decode('UTF-8'))
+
+    def test_gauge_ttl(self):
+        server = make_server(gauge_ttl=60)
+        server.process('depth:5|g')
+        server.flush()
+        server.flush()
+        server.flush()
+        self.assertEqual(len(server.index), 1)
+        server.gauge_values.stamps[0] -= 200
+        server.flush()
+        server.flush()
+
+        self.assertEqual([q.measurements.get('depth', (None,))[0] for q in server.api.queues], [5, 5, 5, None, None])
+        # Freed once the TTL has passed
+        self.assertEqual(len(server.index), 0)
+
+    def test_tagged(self):
+        server = make_server(tagged=True, prefix='app')
+        server.process('requests:1|c|#region:us,az:a\nrequests:2|c|#region:eu\nlatency:5|ms|#region:us,az:a\n'
+                       'url:1|c|#url:http://example.com')
+        server.flush()
+
+        tagged = dict(((name, tuple(sorted(props['tags'].items()))), (value, props))
+                      for name, value, props in server.api.queues[-1].tagged)
+        source = ('source', server.source)
+        self.assertEqual(tagged[('app.requests.count', (('az', 'a'), ('region', 'us'), source))][0], 1)
+        self.assertEqual(tagged[('app.requests.count', (('region', 'eu'), source))][0], 2)
+        self.assertEqual(tagged[('app.url.count', (source, ('url', 'http://example.com')))][0], 1)
+        mean = tagged[('app.latency.mean', (('az', 'a'), ('region', 'us'), source))]
+        self.assertEqual((mean[0], mean[1]['count'], mean[1]['max']), (5, 1, 5))
+
+        # Contexts with the same tags share a tag dict
+        props = [props for name, value, props in server.api.queues[-1].tagged if props['tags'].get('az')]
+        self.assertTrue(all(p['tags'] is props[0]['tags'] for p in props))
+
+        # Counters are reported per interval, not as running totals
+        server.process('requests:3|c|#region:eu')
+        server.flush()
+        self.assertEqual(server.api.queues[-1].measurements['app.requests.count'][0], 3)
+
+
+class BatchedReceiveTest(unittest.TestCase):
+    def setUp(self):
+        self.server = make_server(recv_batch=16)
+        self.server._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server._sock.bind(('127.0.0.1', 0))
+        self.server._sock.setblocking(False)
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def tearDown(self):
+        self.server._sock.close()
+        self.client.close()
+
+    def test_drain(self):
+        addr = self.server._sock.getsockname()
+        for i in range(20):
+            self.client.sendto(b'foo:1|c', addr)
+
+        first = self.server._drain()
+        second = self.server._drain()
+        self.assertEqual(len(first), 16)
+        self.assertEqual(len(second), 4)
+        self.assertEqual(self.server._drain(), [])
+
+        self.server.process_batch(first + second + [(b'\xff\xfe', addr), (b'foo:x|c\nfoo:1|c', addr)])
+        self.assertEqual(aggregates(self.server)['counters'][('foo', ())][0], 21)
+        # The datagram that can't be decoded, and the line that can't be parsed
+        self.assertEqual(self.server.recv_stats['errors'], 2)
+
+    def test_recv_stats(self):
+        self.server.recv_stats.update(wakeups=4, packets=10, max_packets=5, errors=2)
+        self.server.flush()
+
+        measurements = self.server.api.queues[-1].measurements
+        self.assertEqual(measurements['statsd.recv.packets'][0], 10)
+        self.assertEqual(measurements['statsd.recv.errors'][0], 2)
+        self.assertEqual(measurements['statsd.recv.packets_per_wakeup'][0], 2.5)
+        self.assertEqual(measurements['statsd.recv.max_packets_per_wakeup'][0], 5)
+        self.assertEqual(self.server.recv_stats['packets'], 0)
+
+
+PROC_NET_UDP = """\
+   sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode ref pointer drops
+   52: 0100007F:1FCE 00000000:0000 07 00000000:00000A00 00:00000000 00000000     0        0 11115 2 0000000019f4fb7f 17
+   53: 0100007F:1FCF 00000000:0000 07 00000000:00000000 00:00000000 00000000     0        0 11116 2 0000000019f4fb7f 0
+"""
+
+
+class UdpStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'udp')
+        with open(self.path, 'w') as f:
+            f.write(PROC_NET_UDP)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_read(self):
+        self.assertEqual(read_udp_socket_stats(11115, [self.path]), (0xA00, 17))
+        self.assertEqual(read_udp_socket_stats(11116, ['/nonexistent', self.path]), (0, 0))
+        self.assertIsNone(read_udp_socket_stats(11117, [self.path]))
+
+    @unittest.skipUnless(os.path.exists('/proc/net/udp'), 'no /proc/net/udp')
+    def test_flush(self):
+        server = make_server(rcvbuf=65536)
+        server._bind('127.0.0.1', 0)
+        try:
+            client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            client.sendto(b'foo:1|c', server._sock.getsockname())
+            client.close()
+            server.flush()
+        finally:
+            server._sock.close()
+
+        measurements = server.api.queues[-1].measurements
+        self.assertGreater(measurements['statsd.udp.rx_queue'][0], 0)
+        self.assertEqual(measurements['statsd.udp.drops'][0], 0)
+        self.assertGreaterEqual(measurements['statsd.udp.rcvbuf'][0], 65536)
+
+    @unittest.skipUnless(os.path.exists('/proc/sys/net/core/rmem_max') and sys.version_info >= (3, 4),
+                         'no net.core.rmem_max, or no assertLogs')
+    def test_rcvbuf_capped(self):
+        with open('/proc/sys/net/core/rmem_max') as f:
+            rmem_max = int(f.read())
+        server = make_server(rcvbuf=rmem_max * 3 // 2)
+        with self.assertLogs('librato_python_web.statsd.server.statsd_server', 'WARNING') as logs:
+            server._bind('127.0.0.1', 0)
+        server._sock.close()
+
+        self.assertIn('got %d' % rmem_max, logs.output[0])
+
+
+class PipelineTest(unittest.TestCase):
+    def test_drop_newest(self):
+        server = make_server(queue_size=2)
+        for i in range(4):
+            server.enqueue([(b'foo:%d|c' % i, None)])
+
+        self.assertEqual(server.queue_stats['drops'], 2)
+        self.assertEqual(server._queue.get_nowait(), [(b'foo:0|c', None)])
+
+    def test_drop_oldest(self):
+        server = make_server(queue_size=2, queue_policy='drop-oldest')
+        for i in range(4):
+            server.enqueue([(b'foo:%d|c' % i, None)])
+
+        self.assertEqual(server.queue_stats['drops'], 2)
+        self.assertEqual(server._queue.get_nowait(), [(b'foo:2|c', None)])
+
+    def test_bad_policy(self):
+        self.assertRaises(ValueError, make_server, queue_policy='drop-everything')
+
+    def test_pipeline(self):
+        server = make_server(queue_size=16, recv_batch=8)
+        server._bind('127.0.0.1', 0)
+        parser = threading.Thread(target=server._serve_pipelined)
+        parser.start()
+
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for i in range(20):
+            client.sendto(b'foo:1|c', server._sock.getsockname())
+        client.close()
+
+        for _ in range(50):
+            if aggregates(server)['counters'].get(('foo', ()), [0])[0] == 20:
+                break
+            time.sleep(0.05)
+
+        server._sock.close()
+        server._force_enqueue(None)
+        parser.join(5)
+        self.assertFalse(parser.is_alive())
+        self.assertEqual(aggregates(server)['counters'][('foo', ())][0], 20)
+
+        server.flush()
+        measurements = server.api.queues[-1].measurements
+        self.assertEqual(measurements['statsd.queue.drops'][0], 0)
+        self.assertIn('statsd.queue.depth', measurements)
+        self.assertIn('statsd.queue.max_depth', measurements)
+
+
+class StreamTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'statsd.sock')
+        self.server = make_server(unix_socket=self.path)
+        self.server.start_listeners('127.0.0.1')
+
+    def tearDown(self):
+        for listener in self.server._listeners:
+            listener.stop()
+        shutil.rmtree(self.dir)
+
+    def test_line_buffer(self):
+        lines = LineBuffer(max_line_length=16)
+        self.assertIsNone(lines.feed(b'foo:1'))
+        self.assertEqual(lines.feed(b'|c\nbar:'), b'foo:1|c')
+        self.assertEqual(lines.feed(b'2|c\nbaz:1|c\nfoo'), b'bar:2|c\nbaz:1|c')
+        self.assertEqual(lines.close(), b'foo')
+        self.assertIsNone(lines.close())
+
+        self.assertIsNone(lines.feed(b'x' * 17))
+        self.assertEqual(lines.partial, b'')
+
+    def test_unix_socket(self):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(self.path)
+        for i in range(1000):
+            client.sendall(b'foo:1|c\nbaz:')
+            client.sendall(b'10|ms\n')
+        client.sendall(b'bar:5|g')
+        client.close()
+
+        for _ in range(50):
+            if ('bar', ()) in aggregates(self.server)['gauges']:
+                break
+            time.sleep(0.05)
+
+        self.assertEqual(aggregates(self.server)['counters'][('foo', ())][0], 1000)
+        self.assertEqual(len(aggregates(self.server)['timers'][('baz', ())][0]), 1000)
+        self.assertEqual(aggregates(self.server)['gauges'][('bar', ())][0], 5)
+
+    def test_bad_lines(self):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(self.path)
+        client.sendall(b'foo:1|c\nfoo:x|c\n_a:web|foo\nfoo:2|c\nbaz:y|ms\nbar:5|g\n')
+        client.close()
+
+        for _ in range(50):
+            if ('bar', ()) in aggregates(self.server)['gauges']:
+                break
+            time.sleep(0.05)
+
+        # Only the bad lines were skipped
+        self.assertEqual(aggregates(self.server)['counters'][('foo', ())][0], 3)
+        self.assertEqual(aggregates(self.server)['gauges'][('bar', ())][0], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
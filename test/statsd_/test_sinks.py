@@ -0,0 +1,141 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from librato_python_web.statsd.server.sinks import FileSink, MemorySink, Sink, SinkWorker, benchmark
+from librato_python_web.statsd.server.snapshot import COUNTER, GAUGE, HISTOGRAM, TIMER, Measurement, Snapshot
+from statsd_.servertest_base import make_server
+
+
+class BlockingSink(Sink):
+    name = 'blocking'
+
+    def __init__(self):
+        self.entered = threading.Event()
+        self.released = threading.Event()
+        self.snapshots = []
+
+    def send(self, snapshot):
+        self.entered.set()
+        self.released.wait(5)
+        self.snapshots.append(snapshot)
+
+
+class FailingSink(Sink):
+    name = 'failing'
+
+    def send(self, snapshot):
+        raise IOError('disk full')
+
+
+class SinkTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_snapshot(self):
+        memory = MemorySink()
+        server = make_server(sinks=['librato', memory], histograms_by_prefix={'api.': [100]})
+        server.process('foo:1|c|#region:us\nbar:2.5|g\nbaz:10|ms\nbaz:20|ms\napi.request:50|ms')
+        server.flush()
+
+        measurements = dict((m.name, m) for m in memory.last.measurements)
+        self.assertEqual(measurements['foo'], Measurement('foo', COUNTER, 1, (('region', 'us'),)))
+        self.assertEqual(measurements['bar'], Measurement('bar', GAUGE, 2.5, ()))
+        self.assertEqual(measurements['baz'].kind, TIMER)
+        self.assertEqual((measurements['baz'].value.median, measurements['baz'].value.count), (15, 2))
+        self.assertEqual(measurements['api.request'].value, ((100, 1), (None, 1)))
+        self.assertEqual(measurements['api.request'].kind, HISTOGRAM)
+        # The librato sink got the same measurements
+        self.assertEqual(server.api.queues[-1].measurements['baz.median'][0], 15)
+
+    def test_memory_sink(self):
+        server = make_server(sinks=['memory'])
+        for _ in range(3):
+            server.flush()
+
+        self.assertEqual(len(server.sinks[0].sink.snapshots), 1)
+
+    def test_file_sink(self):
+        path = os.path.join(self.directory, 'flushes.jsonl')
+        server = make_server(sinks=['file:' + path])
+        server.process('foo:1|c|#region:us\nbaz:10|ms')
+        server.flush()
+        server.stop_sinks()
+
+        with open(path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(server.api.queues, [])
+        self.assertIn({'time': lines[0]['time'], 'name': 'foo', 'type': 'counter', 'value': 1,
+                       'tags': {'region': 'us'}}, lines)
+        timer = [line for line in lines if line['name'] == 'baz'][0]
+        self.assertEqual((timer['value']['median'], timer['value']['percentiles']), (10, {'90': 10}))
+
+    def test_slow_sink(self):
+        blocking = BlockingSink()
+        server = make_server(sinks=[blocking, 'librato'], sink_queue_size=2)
+        server.start_sinks()
+        for i in range(1, 5):
+            server.process('foo:%d|g' % i)
+            # Neither the flush nor the other sink wait for the blocked one
+            server.flush()
+            blocking.entered.wait(5)
+        blocking.released.set()
+        server.stop_sinks()
+
+        self.assertEqual(len(server.api.queues), 4)
+        # The first snapshot was being delivered, the next one was dropped to make room
+        self.assertEqual([dict((m.name, m.value) for m in s.measurements)['foo'] for s in blocking.snapshots],
+                         [1, 3, 4])
+        self.assertEqual(server.api.queues[-1].measurements['statsd.sink.blocking.pending'][0], 2)
+        self.assertEqual(server.sinks[0].take_stats()['dropped'], 1)
+
+    def test_errors(self):
+        worker = SinkWorker(FailingSink())
+        worker.send(Snapshot(0, ()))
+
+        stats = worker.take_stats()
+        self.assertEqual((stats['sent'], stats['errors']), (0, 1))
+
+    def test_benchmark(self):
+        snapshot = Snapshot(0, tuple(Measurement('foo%d' % i, GAUGE, i, ()) for i in range(100)))
+        sink = FileSink(os.path.join(self.directory, 'flushes.jsonl'))
+        try:
+            self.assertGreater(benchmark(sink, snapshot, repeat=10), 0)
+        finally:
+            sink.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import random
+import unittest
+
+from librato_python_web.statsd.server.sketch import DDSketch
+from statsd_.servertest_base import aggregates, make_server
+
+
+def exact_quantile(values, q):
+    return sorted(values)[int(q * (len(values) - 1))]
+
+
+class SketchTest(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(42)
+        self.values = [self.random.lognormvariate(3, 1.5) for _ in range(20000)]
+
+    def assertAccurate(self, sketch, values, accuracy):
+        for q in (0.0, 0.1, 0.5, 0.9, 0.95, 0.99, 0.999, 1.0):
+            expected = exact_quantile(values, q)
+            self.assertLessEqual(abs(sketch.quantile(q) - expected), accuracy * abs(expected) + 1e-9, q)
+
+    def test_quantiles(self):
+        for accuracy in (0.01, 0.05):
+            sketch = DDSketch(accuracy)
+            sketch.extend(self.values)
+            self.assertAccurate(sketch, self.values, accuracy)
+
+    def test_exact_stats(self):
+        sketch = DDSketch()
+        sketch.extend(self.values)
+
+        self.assertEqual(sketch.count, len(self.values))
+        self.assertEqual(sketch.min, min(self.values))
+        self.assertEqual(sketch.max, max(self.values))
+        self.assertAlmostEqual(sketch.sum, sum(self.values), places=3)
+        self.assertAlmostEqual(sketch.sum_squares / sum([v ** 2 for v in self.values]), 1.0)
+
+    def test_merge(self):
+        left, right = DDSketch(), DDSketch()
+        left.extend(self.values[:5000])
+        right.extend(self.values[5000:])
+        left.extend(right)
+
+        whole = DDSketch()
+        whole.extend(self.values)
+        self.assertEqual(left.positive, whole.positive)
+        self.assertEqual(left.count, whole.count)
+        self.assertEqual(left.max, whole.max)
+        self.assertRaises(ValueError, left.extend, DDSketch(0.05))
+
+    def test_negative_and_zero(self):
+        values = [self.random.uniform(-100, 100) for _ in range(5000)] + [0.0] * 500
+        sketch = DDSketch()
+        sketch.extend(values)
+        self.assertAccurate(sketch, values, 0.01)
+
+    def test_bounded(self):
+        sketch = DDSketch(0.01, max_bins=64)
+        sketch.extend([1.5 ** i for i in range(500)])
+
+        self.assertLessEqual(len(sketch.positive), 64)
+        self.assertEqual(sketch.count, 500)
+        # The upper quantiles are unaffected by collapsing
+        self.assertLessEqual(abs(sketch.quantile(0.99) / 1.5 ** 494 - 1), 0.01)
+
+    def test_multiple_quantiles(self):
+        sketch = DDSketch()
+        sketch.extend(self.values)
+        qs = [0.99, 0.5, 0.999, 0.0, 0.9]
+
+        self.assertEqual(sketch.quantiles(qs), [sketch.quantile(q) for q in qs])
+
+    def test_empty(self):
+        self.assertIsNone(DDSketch().quantile(0.5))
+        self.assertEqual(DDSketch().quantiles([0.5, 0.9]), [None, None])
+
+
+class SketchTimerTest(unittest.TestCase):
+    def test_flush(self):
+        server = make_server(timer_storage='sketch', pct_threshold=[90, 99])
+        server.process('\n'.join('baz:%d|ms' % i for i in range(1, 101)))
+        server.flush()
+
+        measurements = server.api.queues[-1].measurements
+        self.assertEqual(measurements['baz.count'][0], 100)
+        self.assertAlmostEqual(measurements['baz.median'][0], 50, delta=1)
+        self.assertAlmostEqual(measurements['baz.upper_90'][0], 90, delta=1)
+        self.assertAlmostEqual(measurements['baz.upper_99'][0], 99, delta=1)
+        mean = measurements['baz.mean'][2]
+        self.assertEqual((mean['min'], mean['max'], mean['sum']), (1, 100, 5050))
+
+    def test_merge_shards(self):
+        server = make_server(timer_storage='sketch')
+        for i in range(3):
+            worker = make_server(timer_storage='sketch')
+            worker.process('baz:%d|ms' % i)
+            server.merge_shard(worker.export_shard())
+
+        sketch = aggregates(server)['timers'][('baz', ())][0]
+        self.assertEqual((sketch.count, sketch.min, sketch.max), (3, 0, 2))
+
+    def test_bad_storage(self):
+        self.assertRaises(ValueError, make_server, timer_storage='tape')
+
+
+if __name__ == '__main__':
+    unittest.main()
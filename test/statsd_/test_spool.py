@@ -0,0 +1,185 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from librato_python_web.statsd.server.spool import Spool, HEADER
+from librato_python_web.statsd.server.statsd_server import Server
+from statsd_.servertest_base import FakeApiServer
+
+
+class SpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def segments(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_append(self):
+        spool = Spool(self.directory, segment_size=256)
+        first = spool.append(b'first')
+        second = spool.append(b'second')
+
+        self.assertEqual(spool.read(first), b'first')
+        self.assertEqual(spool.read(second), b'second')
+        self.assertEqual(spool.pending(), [])
+
+    def test_segments(self):
+        spool = Spool(self.directory, segment_size=256)
+        records = [spool.append(b'x' * 100) for _ in range(5)]
+        # Payloads larger than a segment get a segment of their own
+        big = spool.append(b'y' * 1000)
+
+        self.assertEqual([record[0] for record in records + [big]], [0, 0, 1, 1, 2, 3])
+        self.assertEqual(spool.read(big), b'y' * 1000)
+
+        spool.ack(records[0])
+        spool.ack(records[1])
+        self.assertEqual(self.segments(), ['0000000000000001.spool', '0000000000000002.spool',
+                                           '0000000000000003.spool'])
+
+    def test_replay(self):
+        spool = Spool(self.directory, segment_size=256)
+        records = [spool.append(str(i).encode('ascii') * 50) for i in range(4)]
+        spool.ack(records[0])
+        spool.ack(records[2])
+        spool.close()
+
+        spool = Spool(self.directory, segment_size=256)
+        replayed = spool.pending()
+        self.assertEqual([spool.read(record) for record in replayed], [b'1' * 50, b'3' * 50])
+
+        # Appending carries on after the replayed records
+        record = spool.append(b'more')
+        self.assertEqual(record[0], replayed[-1][0])
+        self.assertEqual(spool.read(record), b'more')
+
+    def test_torn_write(self):
+        spool = Spool(self.directory, segment_size=256)
+        spool.append(b'complete')
+        torn = spool.append(b'torn')
+        segment = spool.segments[torn[0]]
+        start = torn[1] + HEADER.size
+        segment.mmap[start:start + 4] = b'xxxx'
+        spool.close()
+
+        spool = Spool(self.directory, segment_size=256)
+        self.assertEqual([spool.read(record) for record in spool.pending()], [b'complete'])
+
+    def test_max_bytes(self):
+        spool = Spool(self.directory, max_bytes=600, segment_size=256)
+        records = [spool.append(b'x' * 200) for _ in range(4)]
+
+        self.assertEqual([spool.read(record) for record in records], [None, None, b'x' * 200, b'x' * 200])
+        self.assertEqual(self.segments(), ['0000000000000002.spool', '0000000000000003.spool'])
+
+    def test_max_age(self):
+        spool = Spool(self.directory, max_age=60, segment_size=256)
+        records = [spool.append(b'x' * 200) for _ in range(2)]
+        spool.segments[0].newest = time.time() - 120
+        records.append(spool.append(b'x' * 200))
+
+        self.assertEqual([spool.read(record) for record in records], [None, b'x' * 200, b'x' * 200])
+
+    def test_max_age_on_open(self):
+        spool = Spool(self.directory, max_age=60, segment_size=256)
+        old = spool.append(b'old')
+        new = spool.append(b'new')
+        self.age(spool, old, 7 * 24 * 60 * 60)
+        # Given up on without waiting for another append, although its segment is still in use
+        self.assertIsNone(spool.read(old))
+        spool.close()
+
+        spool = Spool(self.directory, max_age=60, segment_size=256)
+        self.assertEqual(spool.pending(), [new])
+        self.age(spool, new, 7 * 24 * 60 * 60)
+        spool.close()
+
+        # A quiet segment is deleted once its newest record is past the cap
+        spool = Spool(self.directory, max_age=60, segment_size=256)
+        self.assertEqual(spool.pending(), [])
+        self.assertEqual(self.segments(), [])
+        self.assertEqual(spool.read(spool.append(b'more')), b'more')
+
+    def test_max_bytes_on_open(self):
+        spool = Spool(self.directory, segment_size=256)
+        for _ in range(3):
+            spool.append(b'x' * 200)
+        spool.close()
+
+        spool = Spool(self.directory, max_bytes=300, segment_size=256)
+        self.assertEqual(self.segments(), ['0000000000000002.spool'])
+        self.assertEqual(len(spool.pending()), 1)
+
+    @staticmethod
+    def age(spool, record, seconds):
+        """Makes a record look like it was appended the given number of seconds earlier."""
+        segment = spool.segments[record[0]]
+        header = segment.mmap[record[1]:record[1] + HEADER.size]
+        state, length, crc, created = HEADER.unpack(header)
+        segment.mmap[record[1]:record[1] + HEADER.size] = HEADER.pack(state, length, crc, created - seconds)
+
+
+class SpooledServerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_replay(self):
+        # The API is down until the server restarts
+        api = FakeApiServer(failures=1000)
+        server = Server('user@example.com', 'token', spool_dir=self.directory, librato_hostname=api.url)
+        server.sender.retry_initial = 0.01
+        server.sender.start()
+        server.process('foo:1|c')
+        server.flush()
+        server.sender.stop(timeout=0.1)
+        api.close()
+
+        api = FakeApiServer()
+        try:
+            server = Server('user@example.com', 'token', spool_dir=self.directory, librato_hostname=api.url)
+            server.sender.start()
+            server.sender.stop(timeout=5)
+        finally:
+            api.close()
+
+        self.assertEqual(len(api.requests), 1)
+        self.assertIn('foo.count', [m['name'] for m in api.requests[0][1]['counters']])
+        self.assertEqual(server.sender.spool.pending(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,220 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import sys
+import unittest
+
+from librato_python_web.statsd.server.store import BufferColumn, Generation, LastSeen, SeriesIndex, ValueColumn, \
+    OVERFLOW, OVERFLOW_TAGS
+from statsd_.servertest_base import make_server
+
+
+def series_memory(series):
+    """
+    Measures the memory used by counters kept in a dict of lists and in a value column, using tracemalloc.
+    :param series: the number of distinct series
+    :return: a (dict of lists, column) tuple of bytes used
+    """
+    import tracemalloc
+    contexts = [('app.counter.%d' % i, (('host', 'web-%d' % (i % 10)),)) for i in range(series)]
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    counters = {}
+    for context in contexts:
+        counters.setdefault(context, [0, 1])[0] += 1.0
+    dicts = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del counters
+
+    # The index is built once, a column is allocated per generation
+    index = SeriesIndex()
+    for context in contexts:
+        index.id_of(context)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    column = ValueColumn(len(index))
+    for context in contexts:
+        column.add(index.id_of(context), 1.0, 1)
+    columns = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    return dicts, columns
+
+
+class StoreTest(unittest.TestCase):
+    def test_index(self):
+        index = SeriesIndex()
+        self.assertEqual(index.id_of(('foo', ())), 0)
+        self.assertEqual(index.id_of(('bar', (('a', '1'),))), 1)
+        self.assertEqual(index.id_of(('foo', ())), 0)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.contexts[1], ('bar', (('a', '1'),)))
+
+    def test_index_caps(self):
+        index = SeriesIndex(max_series=4, max_series_per_metric=2)
+        for request_id in range(10):
+            index.id_of(('requests', (('request_id', str(request_id)),)))
+        index.id_of(('errors', ()))
+        index.id_of(('latency', ()))
+        index.id_of(('other', ()))
+
+        self.assertEqual(index.contexts, [
+            ('requests', (('request_id', '0'),)),
+            ('requests', (('request_id', '1'),)),
+            ('requests', OVERFLOW_TAGS),
+            ('errors', ()),
+            (OVERFLOW, ())
+        ])
+        self.assertEqual(index.id_of(('requests', (('request_id', '1'),))), 1)
+        self.assertEqual(index.id_of(('requests', (('request_id', '99'),))), 4)
+        # Rejected contexts are counted once however many samples they get
+        index.id_of(('requests', (('request_id', '5'),)))
+        self.assertEqual(round(index.take_rejected().cardinality()), 11)
+        self.assertEqual(round(index.take_rejected().cardinality()), 0)
+
+    def test_index_remove(self):
+        index = SeriesIndex(max_series_per_metric=2)
+        index.id_of(('foo', (('a', '1'),)))
+        index.id_of(('foo', (('a', '2'),)))
+        index.remove(0)
+
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.id_of(('foo', (('a', '3'),))), 0)
+        self.assertEqual(index.contexts, [('foo', (('a', '3'),)), ('foo', (('a', '2'),))])
+        self.assertEqual(round(index.take_rejected().cardinality()), 0)
+
+    def test_index_remove_overflow(self):
+        index = SeriesIndex(max_series_per_metric=2)
+        for i in range(3):
+            index.id_of(('foo', (('a', str(i)),)))
+        index.remove(index.id_of(('foo', OVERFLOW_TAGS)))
+
+        # The metric name is still at its cap
+        self.assertEqual(index.id_of(('foo', (('a', '3'),))), 2)
+        self.assertEqual(index.contexts[2], ('foo', OVERFLOW_TAGS))
+
+    def test_last_seen(self):
+        last_seen = LastSeen()
+        last_seen.touch(1, 100)
+        last_seen.touch(2, 110)
+        last_seen.touch(3, 120)
+        last_seen.touch(1, 130)
+
+        self.assertEqual(list(last_seen.expired(115)), [2])
+        self.assertEqual(list(last_seen.expired(115)), [])
+        self.assertEqual(list(last_seen.expired(131)), [3, 1])
+        self.assertEqual(last_seen.heap, [])
+
+    def test_server_expire(self):
+        server = make_server(expire=60)
+        server.process('idle:1|c\nidle:1|g\nbusy:1|c')
+        server.flush()
+        server.last_seen.stamps[0] -= 120
+        server.last_seen.heap[0] = (server.last_seen.heap[0][0] - 120, 0)
+        server.process('busy:1|c')
+        server.flush()
+
+        self.assertEqual(server.index.contexts, [None, ('busy', ())])
+        measurements = server.api.queues[-1].measurements
+        self.assertNotIn('idle.count', measurements)
+        self.assertEqual(measurements['busy.count'][0], 2)
+
+    def test_server_free(self):
+        server = make_server()
+        server.process('\n'.join('request:1|ms|#id:%d' % i for i in range(1000)))
+        server.process('hits:1|c\nlevel:+1|g\ntemp:20|g\nusers:a|s\nsize:1|h')
+        server.flush()
+        server.process('request:1|ms|#id:0')
+        server.flush()
+
+        # Only the counter, the base of gauge deltas and the timer still in use are kept
+        self.assertEqual(sorted(server.index.ids), [('hits', ()), ('level', ()), ('request', (('id', '0'),))])
+        self.assertEqual(len(server.generation.counters), len(server.index))
+
+        server.process('level:+1|g\ntemp:+1|g')
+        server.flush()
+        measurements = server.api.queues[-1].measurements
+        self.assertEqual(measurements['level'][0], 2)
+        self.assertEqual(measurements['temp'][0], 1)
+        self.assertEqual(measurements['hits.count'][0], 1)
+        self.assertEqual(sorted(server.index.ids), [('hits', ()), ('level', ()), ('temp', ())])
+
+    def test_server_caps(self):
+        server = make_server(max_series_per_metric=1)
+        server.process('requests:1|c|#id:1\nrequests:1|c|#id:2\nrequests:1|c|#id:3\nrequests:1|c|#id:3')
+
+        self.assertEqual(server.generation.counters.get(server.index.id_of(('requests', OVERFLOW_TAGS)))[0], 3)
+
+        server.flush()
+        measurements = server.api.queues[-1].measurements
+        self.assertEqual(measurements['statsd.series.count'][0], 2)
+        self.assertEqual(measurements['statsd.series.rejected'][0], 2)
+
+    def test_value_column(self):
+        column = ValueColumn()
+        column.add(100, 1.0, 10)
+        column.add(100, 2.0, 11)
+        column.set(3, 5.0, 12)
+
+        self.assertGreater(len(column), 100)
+        self.assertEqual(column.get(100), (3.0, 11))
+        self.assertIsNone(column.get(4))
+        self.assertIsNone(column.get(1000))
+        self.assertEqual(list(column.items()), [(3, 5.0, 12), (100, 3.0, 11)])
+
+    def test_buffer_column(self):
+        column = BufferColumn(list)
+        column.buffer(2, 10).append(1)
+        column.buffer(2, 9).append(2)
+
+        self.assertEqual(column.get(2), ([1, 2], 10))
+        self.assertEqual(list(column.items()), [(2, [1, 2], 10)])
+
+    def test_to_dicts(self):
+        index = SeriesIndex()
+        generation = Generation(list, set, list, len(index))
+        generation.counters.add(index.id_of(('foo', ())), 1, 10)
+        generation.timers.buffer(index.id_of(('bar', ())), 11).append(2.0)
+        generation.sets.buffer(index.id_of(('baz', ())), 12).add('a')
+
+        self.assertEqual(generation.to_dicts(index), {
+            'counters': {('foo', ()): [1, 10]},
+            'gauges': {},
+            'gauge_deltas': {},
+            'timers': {('bar', ()): [[2.0], 11]},
+            'timer_counts': {},
+            'sets': {('baz', ()): [set(['a']), 12]},
+            'histograms': {}
+        })
+
+    @unittest.skipIf(sys.version_info < (3, 4), 'tracemalloc is not available')
+    def test_memory(self):
+        dicts, columns = series_memory(100000)
+        self.assertLess(columns, dicts / 4)
+
+if __name__ == '__main__':
+    unittest.main()
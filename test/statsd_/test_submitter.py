@@ -0,0 +1,126 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import time
+import unittest
+
+import librato
+from librato.exceptions import BadRequest
+
+from librato_python_web.statsd.server.statsd_server import Server
+from librato_python_web.statsd.server.submitter import Submitter, SubmitError
+from statsd_.servertest_base import FakeApiServer
+
+
+class SubmitterTest(unittest.TestCase):
+    def setUp(self):
+        self.api = FakeApiServer()
+        self.connection = librato.connect('user@example.com', 'token', hostname=self.api.url.split('://')[1],
+                                          protocol='http')
+        self.submitter = Submitter(concurrency=2)
+
+    def tearDown(self):
+        self.submitter.close()
+        self.api.close()
+
+    def new_queue(self, size=1000):
+        queue = self.connection.new_queue()
+        for i in range(size):
+            queue.add('metric.%d' % i, i)
+        return queue
+
+    def test_submit(self):
+        for _ in range(2):
+            queue = self.new_queue()
+            self.submitter.submit(queue)
+            self.assertEqual(queue.chunks, [])
+
+        self.assertEqual(len(self.api.requests), 8)
+        names = set(m['name'] for _, body in self.api.requests for m in body['gauges'])
+        self.assertEqual(len(names), 1000)
+        # Connections are kept alive across chunks and submissions
+        self.assertLessEqual(len(self.api.clients), 2)
+
+        stats = self.submitter.take_stats()
+        self.assertEqual((stats['chunks'], stats['errors']), (8, 0))
+        self.assertLess(stats['bytes'], stats['raw_bytes'] / 4)
+        self.assertEqual(stats['latency']['count'], 8)
+        self.assertGreater(stats['latency']['max'], 0)
+
+    def test_uncompressed(self):
+        self.submitter.compress = False
+        self.submitter.submit(self.new_queue(10))
+
+        stats = self.submitter.take_stats()
+        self.assertEqual(stats['bytes'], stats['raw_bytes'])
+        self.assertEqual(len(self.api.requests[0][1]['gauges']), 10)
+
+    def test_retry(self):
+        self.api.failures = 1
+        queue = self.new_queue()
+        self.assertRaises(IOError, self.submitter.submit, queue)
+        # Only the failed chunk is left to retry
+        self.assertEqual(len(queue.chunks), 1)
+
+        self.submitter.submit(queue)
+        self.assertEqual(len(self.api.requests), 4)
+        self.assertEqual(self.submitter.take_stats()['errors'], 1)
+
+    def test_idle_connections(self):
+        self.api.close()
+        self.api = FakeApiServer(idle_timeout=0.1)
+        self.connection.hostname = self.api.url.split('://')[1]
+        for _ in range(3):
+            self.submitter.submit(self.new_queue(10))
+            # The API closes the kept-alive connections in the meantime
+            time.sleep(0.3)
+
+        self.assertEqual(len(self.api.requests), 3)
+        self.assertEqual(self.submitter.take_stats()['errors'], 0)
+
+    def test_errors(self):
+        self.api.status = 503
+        self.assertRaises(SubmitError, self.submitter.submit, self.new_queue(10))
+        self.api.status = 400
+        self.assertRaises(BadRequest, self.submitter.submit, self.new_queue(10))
+
+    def test_server(self):
+        server = Server('user@example.com', 'token', submit_concurrency=2, librato_hostname=self.api.url)
+        try:
+            server.process('foo:1|c')
+            server.flush()
+            server.flush()
+        finally:
+            server.submitter.close()
+
+        names = [m['name'] for _, body in self.api.requests for m in body['gauges'] + body['counters']]
+        self.assertIn('foo.count', names)
+        for name in ('chunks', 'errors', 'bytes', 'raw_bytes', 'latency'):
+            self.assertIn('statsd.submit.' + name, names)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import random
+import sys
+import unittest
+from array import array
+
+from librato_python_web.statsd.server import summary
+
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+class SummaryTest(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(42)
+        self.series = [[rnd.expovariate(0.01) for _ in range(n)] for n in (1, 2, 3, 64, 65, 1000, 1001)]
+
+    def assertSummaryEqual(self, actual, expected):
+        # Order statistics are exact, sums may differ in rounding
+        self.assertEqual(actual[:3], expected[:3])
+        self.assertEqual(actual[4:6], expected[4:6])
+        for i in (3, 6, 7):
+            self.assertAlmostEqual(actual[i] / expected[i], 1.0)
+
+    def test_values(self):
+        count, min_, max_, mean, median, thresholds, total, sum_squares = summary.summarize_values(
+            [4.0, 1.0, 3.0, 2.0], [50, 75])
+
+        self.assertEqual((count, min_, max_, mean, median), (4, 1, 4, 2.5, 2.5))
+        self.assertEqual(thresholds, [(50, 2), (75, 3)])
+        self.assertEqual((total, sum_squares), (10, 30))
+
+    def test_array(self):
+        for values in self.series:
+            expected = summary.summarize_values(list(values), PERCENTILES)
+            actual = summary.summarize(array('d', values), PERCENTILES)
+            self.assertSummaryEqual(actual, expected)
+
+    @unittest.skipIf(summary.numpy is None, 'numpy is not installed')
+    def test_vectorized(self):
+        for values in self.series[3:]:
+            expected = summary.summarize_values(list(values), PERCENTILES)
+            actual = summary.summarize_array(array('d', values), PERCENTILES)
+            self.assertSummaryEqual(actual, expected)
+
+    @unittest.skipIf(sys.version_info < (3, 4), 'tracemalloc is not available')
+    def test_memory(self):
+        import tracemalloc
+        samples = 100000
+        values = summary.new_values()
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for i in range(samples):
+            values.append(float(i))
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+
+        self.assertLess(float(used) / samples, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+# Copyright (c) 2015. Librato, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Librato, Inc. nor the names of project contributors
+#       may be used to endorse or promote products derived from this software
+#       without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL LIBRATO, INC. BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import multiprocessing
+import socket
+import threading
+import time
+import unittest
+
+from librato_python_web.statsd.server.statsd_server import Server
+from librato_python_web.statsd.server.workers import ShardedServer
+from statsd_.servertest_base import FakeApi, aggregates, free_port, make_server
+
+
+class ShardTest(unittest.TestCase):
+    def test_merge(self):
+        server = make_server()
+        worker1 = make_server()
+        worker2 = make_server()
+        worker1.process('foo:1|c\nbar:1|g\nbaz:10|ms')
+        worker2.process('foo:2|c\nbar:2|g\nbaz:20|ms\nbaz:30|ms')
+
+        server.merge_shard(worker1.export_shard())
+        server.merge_shard(worker2.export_shard())
+
+        self.assertEqual(aggregates(worker1)['counters'], {})
+        self.assertEqual(aggregates(server)['counters'][('foo', ())][0], 3)
+        self.assertIn(aggregates(server)['gauges'][('bar', ())][0], (1, 2))
+        self.assertEqual(sorted(aggregates(server)['timers'][('baz', ())][0]), [10, 20, 30])
+
+    def test_counters_accumulate(self):
+        server = make_server()
+        worker = make_server()
+        for _ in range(3):
+            worker.process('foo:1|c')
+            server.merge_shard(worker.export_shard())
+            server.flush()
+
+        self.assertEqual(server.api.queues[-1].measurements['foo.count'][0], 3)
+
+
+@unittest.skipUnless(hasattr(socket, 'SO_REUSEPORT'), 'SO_REUSEPORT is not supported')
+class ShardedServerTest(unittest.TestCase):
+    def test_late_reply(self):
+        server = ShardedServer('user@example.com', 'token', workers=1, no_aggregate_counters=True)
+        server.api = FakeApi()
+        worker = make_server()
+        conn, child_conn = multiprocessing.Pipe()
+
+        def run_worker():
+            for i in range(1, 4):
+                seq = child_conn.recv()
+                worker.process('foo:%d|c' % i)
+                if i == 1:
+                    # Misses the first flush
+                    time.sleep(0.5)
+                child_conn.send((seq, worker.export_shard()))
+
+        # A thread stands in for the worker process
+        proc = threading.Thread(target=run_worker)
+        proc.daemon = True
+        proc.start()
+        server._procs, server._conns = [proc], [conn]
+
+        for timeout in (0.1, 2, 2):
+            server.collect_shards(timeout)
+            Server.flush(server)
+
+        counts = [queue.measurements.get('foo.count', (None,))[0] for queue in server.api.queues]
+        # The late shard is merged with the next one, after which flushes are current again
+        self.assertEqual(counts, [None, 3, 3])
+
+    def test_workers(self):
+        port = free_port(socket.SOCK_DGRAM)
+        server = ShardedServer('user@example.com', 'token', workers=2)
+        server.api = FakeApi()
+        server.start_workers('127.0.0.1', port)
+        try:
+            # Let the workers bind before sending
+            time.sleep(0.5)
+            client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            for i in range(50):
+                # Distinct source ports are hashed to different workers
+                client.sendto(b'foo:1|c\nbaz:1|ms', ('127.0.0.1', port))
+                if i % 10 == 9:
+                    client.close()
+                    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            client.close()
+            time.sleep(0.5)
+
+            server.flush()
+        finally:
+            server.stop()
+
+        measurements = server.api.queues[-1].measurements
+        self.assertEqual(measurements['foo.count'][0], 50)
+        self.assertEqual(measurements['baz.count'][0], 50)
+        self.assertEqual(measurements['statsd.recv.packets'][0], 50)
+
+
+if __name__ == '__main__':
+    unittest.main()